@@ -0,0 +1,190 @@
+# Local index of where titles can be watched
+# Every /watch/providers response we get is saved here as (region, provider_id) -> set of media keys.
+# Platform filtering can then be done with set lookups in memory instead of an HTTP call per title.
+# The index is saved to sqlite so it survives restarts and a background thread refreshes old entries.
+import os
+import sqlite3
+import threading
+import time
+
+from app.extensions import get_data_dir
+from app.rate_budget import background_priority
+
+# Provider types that count as "available on". Same ones get_watch_providers has always used
+PROVIDER_TYPES = ["flatrate", "buy", "rent"]
+# Entries older than this aren't trusted for filtering and go upstream again
+MAX_AGE = 24 * 60 * 60
+# Entries older than this are refreshed by the background thread before they expire
+REFRESH_AGE = 12 * 60 * 60
+
+
+def media_key(media_type, media_id):
+    return f"{media_type}:{media_id}"
+
+
+class AvailabilityIndex:
+    def __init__(self, db_path, regions):
+        self.regions = set(regions)
+        self._lock = threading.RLock()
+        # (region, provider_id) -> set of media keys
+        self._providers = {}
+        # media key -> (fetched_at, set of (region, provider_id))
+        self._indexed = {}
+        self.stats = {"hits": 0, "misses": 0, "refreshed": 0}
+        self._refresher = None
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS indexed (media_key TEXT PRIMARY KEY, fetched_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS availability (media_key TEXT, region TEXT, provider_id INTEGER)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS availability_media ON availability (media_key)"
+        )
+        self._conn.commit()
+        self._load()
+
+    # Loads what was saved last time into memory
+    def _load(self):
+        with self._lock:
+            for key, fetched_at in self._conn.execute(
+                "SELECT media_key, fetched_at FROM indexed"
+            ):
+                self._indexed[key] = (fetched_at, set())
+            for key, region, provider_id in self._conn.execute(
+                "SELECT media_key, region, provider_id FROM availability"
+            ):
+                if key not in self._indexed:
+                    continue
+                pair = (region, provider_id)
+                self._indexed[key][1].add(pair)
+                self._providers.setdefault(pair, set()).add(key)
+
+    # Saves the providers from a TMDB /watch/providers "results" object
+    # An empty results object is still recorded since "not available anywhere" is useful to know
+    def record(self, media_type, media_id, results_by_region):
+        key = media_key(media_type, media_id)
+        pairs = set()
+        for region, region_data in (results_by_region or {}).items():
+            if region not in self.regions:
+                continue
+            for provider_type in PROVIDER_TYPES:
+                for provider in region_data.get(provider_type, []):
+                    provider_id = provider.get("provider_id")
+                    if provider_id:
+                        pairs.add((region, provider_id))
+
+        fetched_at = time.time()
+        with self._lock:
+            # Removes the old entries for the title before adding the new ones
+            _, old_pairs = self._indexed.get(key, (0, set()))
+            for pair in old_pairs - pairs:
+                keys = self._providers.get(pair)
+                if keys:
+                    keys.discard(key)
+            for pair in pairs:
+                self._providers.setdefault(pair, set()).add(key)
+            self._indexed[key] = (fetched_at, pairs)
+
+            try:
+                self._conn.execute(
+                    "DELETE FROM availability WHERE media_key = ?", (key,)
+                )
+                self._conn.executemany(
+                    "INSERT INTO availability VALUES (?, ?, ?)",
+                    [(key, region, provider_id) for region, provider_id in pairs],
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO indexed VALUES (?, ?)", (key, fetched_at)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error saving availability for {key}: {e}")
+
+    # Returns the provider ids for a title in a region or None if we don't have fresh data
+    def lookup(self, media_type, media_id, region="US"):
+        key = media_key(media_type, media_id)
+        with self._lock:
+            entry = self._indexed.get(key)
+            if entry is None or time.time() - entry[0] > MAX_AGE:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return [pid for r, pid in entry[1] if r == region]
+
+    # Splits the items into the ones available on the platforms and the ones we still need to look up
+    # The known ones are answered with one set union and a membership check per item
+    def filter(self, items, media_type, platform_ids, region="US"):
+        available = []
+        unknown = []
+        now = time.time()
+        with self._lock:
+            on_platforms = set()
+            for provider_id in platform_ids:
+                on_platforms |= self._providers.get((region, provider_id), set())
+
+            for item in items:
+                key = media_key(media_type, item["id"])
+                entry = self._indexed.get(key)
+                if entry is None or now - entry[0] > MAX_AGE:
+                    self.stats["misses"] += 1
+                    unknown.append(item)
+                    continue
+                self.stats["hits"] += 1
+                if key in on_platforms:
+                    available.append(item)
+        return available, unknown
+
+    # Titles that are getting old, oldest first
+    def stale_keys(self, limit):
+        cutoff = time.time() - REFRESH_AGE
+        with self._lock:
+            stale = [
+                (fetched_at, key)
+                for key, (fetched_at, _) in self._indexed.items()
+                if fetched_at < cutoff
+            ]
+        return [key for _, key in sorted(stale)[:limit]]
+
+    # Starts the background thread that keeps the index fresh
+    # refresh_fn(media_id, media_type) should fetch the providers and call record()
+    def start_refresher(self, refresh_fn, interval=300, batch_size=25):
+        if self._refresher is not None:
+            return
+
+        def refresh_loop():
+            # Refreshes are background work so they only use the spare part of the TMDB rate budget
+            with background_priority():
+                while True:
+                    time.sleep(interval)
+                    for key in self.stale_keys(batch_size):
+                        media_type, media_id = key.split(":", 1)
+                        try:
+                            refresh_fn(media_id, media_type)
+                            self.stats["refreshed"] += 1
+                        except Exception as e:
+                            print(f"Error refreshing availability for {key}: {e}")
+
+        self._refresher = threading.Thread(
+            target=refresh_loop, name="availability-refresh"
+        )
+        self._refresher.daemon = True
+        self._refresher.start()
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0,
+                "titles": len(self._indexed),
+                "provider_keys": len(self._providers),
+            }
+
+
+availability_index = AvailabilityIndex(
+    os.path.join(get_data_dir(), "availability.sqlite3"),
+    regions=os.getenv("PY_AVAILABILITY_REGIONS", "US").split(","),
+)
@@ -4,8 +4,8 @@ from flask import Blueprint, request, jsonify
 import tmdbsimple as tmdb  # Library that makes interacting with TMDB API simplier
 from firebase_admin import firestore
 import datetime
-import time
 from app.extensions import cache, get_db, limiter
+from app.rate_budget import background_priority
 from app.firebase_handler import (
     get_cached_user_ratings,
     get_cached_user_watchlists,
@@ -14,7 +14,9 @@ from app.firebase_handler import (
     get_cached_tv_progress,
     start_all_listeners_for_user,
     shutdown_all_listeners,
+    get_cache_version,
 )
+from app.etags import listener_etag, matching_etag, not_modified, set_etag
 from google.cloud.firestore_v1.base_query import FieldFilter
 
 interactions_bp = Blueprint("interactions", __name__)
@@ -425,13 +427,15 @@ def update_tv_calendar():
 
         updated_count = 0
         for show in tv_shows:
-            time.sleep(0.2)  # Pause to avoid rate limiting
             show_data = show.to_dict()
             media_id = show_data.get("media_id")
 
             # Get latest show information
             tv = tmdb.TV(media_id)
-            tv_info = tv.info()
+            # Calendar refreshes are background work so they wait for the spare part of the TMDB rate budget
+            # instead of pausing between every show
+            with background_priority():
+                tv_info = tv.info()
 
             is_ongoing = (
                 tv_info.get("status") == "Returning Series"
@@ -469,12 +473,12 @@ def update_tv_calendar():
                         calendar_doc.delete()
 
         for movie in movies:
-            time.sleep(0.2)  # Pause to avoid rate limiting
             movie_data = movie.to_dict()
             media_id = movie_data.get("media_id")
 
             movie_api = tmdb.Movies(media_id)
-            movie_info = movie_api.info()
+            with background_priority():
+                movie_info = movie_api.info()
 
             # Check if the movie has a future release date
             if movie_info.get("release_date"):
@@ -655,6 +659,14 @@ def get_followed_media():
     if not user_id:
         return jsonify({"error": "User must be logged in"})
 
+    # The listener cache's version is read before the body is built so the tag is never newer than the data
+    # Nothing is built at all when the browser already has this version
+    listener_key = f"followed_{user_id}"
+    version = get_cache_version(listener_key)
+    etag = listener_etag(listener_key, version) if version is not None else None
+    if etag and matching_etag(etag):
+        return not_modified(etag, "private, no-cache")
+
     followed_media = get_cached_followed_media(user_id)
     user_tv = []
     user_movies = []
@@ -665,7 +677,10 @@ def get_followed_media():
         elif media.get("media_type") == "movie":
             user_movies.append(media)
 
-    return jsonify({"followed_tv": user_tv, "followed_movies": user_movies})
+    response = jsonify({"followed_tv": user_tv, "followed_movies": user_movies})
+    if etag:
+        set_etag(response, etag, "private, no-cache")
+    return response
 
 
 # FOR ADDING TO WATCHLIST
@@ -702,6 +717,13 @@ def get_user_watchlists():
     if not user_id:
         return jsonify({"error": "User login required"})
 
+    # Same as get_followed. Read before the body so the tag is never newer than the data
+    listener_key = f"watchlists_{user_id}"
+    version = get_cache_version(listener_key)
+    etag = listener_etag(listener_key, version) if version is not None else None
+    if etag and matching_etag(etag):
+        return not_modified(etag, "private, no-cache")
+
     watchlists_data = get_cached_user_watchlists(user_id)
 
     watchlists = []
@@ -716,7 +738,10 @@ def get_user_watchlists():
             }
         )
 
-    return jsonify({"watchlists": watchlists})
+    response = jsonify({"watchlists": watchlists})
+    if etag:
+        set_etag(response, etag, "private, no-cache")
+    return response
 
 
 # FOR GETTING WATCHLIST MEDIA FOR ONE WATCHLIST
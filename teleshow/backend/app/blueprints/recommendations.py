@@ -1,12 +1,14 @@
 # Written by Moses Pierre
 from flask import Blueprint, request, jsonify
 import tmdbsimple as tmdb
-import torch.nn.functional as F  # Enabler of machine learning. Allows for the dot
-from app.extensions import cache, limiter, get_db, get_model
-from app.blueprints.search import get_watch_providers, PLATFORM_ID_MAP
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.extensions import cache, limiter, get_db
+from app.embedding_store import embedding_store
+from app.inference_worker import inference_worker
+from app.feature_store import feature_store, unique_ids
+from app.candidate_scoring import score_candidates, to_int_ids
+from app.blueprints.search import get_platform_ids, filter_by_platforms
+from app.view_cache import swr_memoize
 from threading import Thread, Lock
-from ratelimit import limits, sleep_and_retry
 
 
 recommendations_bp = Blueprint("recommendations", __name__)
@@ -23,20 +25,26 @@ def make_rec_cache_key():  # Recommendations' POST method means url isn't unique
     return key_data
 
 
-# Using this function I can cache results that Ive already gotten
-# Reduces API calls
-@cache.memoize(3600)
-def get_media_details(media_id, media_type):
+# Gets what scoring needs to know about a candidate. Called by the feature store for titles it doesn't have
+# Returns (genre_ids, keyword_ids, original_language, popularity)
+def fetch_candidate_features(media_id, media_type):
     media = tmdb.Movies(media_id) if media_type == "movie" else tmdb.TV(media_id)
-    return media.info(append_to_response="keywords")
+    info = media.info(append_to_response="keywords")
+    key = "keywords" if media_type == "movie" else "results"
+    # Keywords is double nested in the response.
+    return (
+        [g["id"] for g in info.get("genres", [])],
+        [k["id"] for k in info.get("keywords", {}).get(key, [])],
+        info.get("original_language"),
+        info.get("popularity", 0),
+    )
 
 
 # FUNCTION FOR CREATING POOL FOR RECOMMENDATIONS
 # CORE ALGORITHM FOR SEARCHING TMDB DISCOVER
 # GETS RECOMMENDATIONS BY SEARCHING USING SPECIFIC DATA FROM SOURCE
-@sleep_and_retry
-@limits(calls=50, period=5)
-@cache.memoize(3600)
+# Each discover call it makes is charged to the TMDB rate budget in the upstream session
+@swr_memoize(soft_ttl=3600, hard_ttl=86400)
 def create_pool_with_discover(
     media_genres,
     media_keywords,
@@ -255,10 +263,11 @@ def create_pool_with_discover(
             )
 
             # Genre matching bonus
+            # Discover results only have genre_ids, and the request's genres are strings
             genre_bonus = 0
             if media_genres and "genre_ids" in item:
-                common_genres = set(media_genres).intersection(
-                    set(item.get("genres", []))
+                common_genres = set(to_int_ids(media_genres)).intersection(
+                    item.get("genre_ids", [])
                 )
                 genre_bonus = len(common_genres) * 5  # 5 points per matching genre
 
@@ -292,39 +301,33 @@ def create_pool_with_discover(
 
 
 # COMPARES TWO OVERVIEWS AND TAGLINES
-@cache.memoize(3600)
-def calculate_similarity(media_title, media_overview, recommendations_list):
-    # Turns text into numerical vector representations
-    rec_titles = [
-        rec.get("title", "") or rec.get("name", "") for rec in recommendations_list
-    ]
-    rec_overviews = [rec.get("overview", "") for rec in recommendations_list]
+# Embeddings come from the embedding store so only titles it hasn't seen are encoded, in one batch
+# The stored vectors are normalized so cosine similarity is one dot product per field
+def calculate_similarity(
+    media_id, media_type, media_title, media_overview, recommendations_list
+):
+    keys = [(media_type, media_id, "title"), (media_type, media_id, "overview")]
+    texts = [media_title or "", media_overview or ""]
+    for rec in recommendations_list:
+        rec_type = rec.get("media_type", media_type)
+        keys.append((rec_type, rec.get("id"), "title"))
+        texts.append(rec.get("title", "") or rec.get("name", ""))
+        keys.append((rec_type, rec.get("id"), "overview"))
+        texts.append(rec.get("overview", ""))
+
+    vectors = embedding_store.get_vectors(keys, texts, encode_texts)
     # Performs consine calculation to find how similiar text segments are. 1 = identical and close to 0 means different
-    # Encode all the overviews
-    # Title similarity
-    title_embeddings = get_model().encode(
-        [media_title] + rec_titles, convert_to_tensor=True, batch_size=16
-    )
-    title_source = title_embeddings[0].unsqueeze(0)
-    title_targets = title_embeddings[1:]
-    title_similarities = F.cosine_similarity(title_source, title_targets).tolist()
+    title_similarities = vectors[2::2] @ vectors[0]
+    overview_similarities = vectors[3::2] @ vectors[1]
 
-    # Overview similarity
-    overview_embeddings = get_model().encode(
-        [media_overview] + rec_overviews, convert_to_tensor=True, batch_size=16
-    )
-    overview_source = overview_embeddings[0].unsqueeze(0)
-    overview_targets = overview_embeddings[1:]
-    overview_similarities = F.cosine_similarity(
-        overview_source, overview_targets
-    ).tolist()
-
-    combined_similarities = [
-        (title_similarities[i] * 0.4) + (overview_similarities[i] * 0.6)
-        for i in range(len(title_similarities))
-    ]
+    combined_similarities = (title_similarities * 0.4) + (overview_similarities * 0.6)
+    return combined_similarities.tolist()
 
-    return combined_similarities
+
+# Turns text into numerical vector representations
+# Goes through the inference worker so encodes from requests running at the same time share one batch
+def encode_texts(texts):
+    return inference_worker.encode(texts)
 
 
 # GENERAL RECOMMENDATIONS
@@ -367,12 +370,7 @@ def get_recommendations():  # Unused data for better recommendations.
 
     recommendations = []
     unique_recs = []
-    filtered_recs = []
     seen = set()
-    genre_sim = 0
-    text_sim = 0
-    keyword_sim = 0
-    popularity_factor = 0
 
     recommendations.extend(
         create_pool_with_discover(
@@ -401,72 +399,35 @@ def get_recommendations():  # Unused data for better recommendations.
     recs_to_compare = [rec for rec in unique_recs if rec.get("overview")]
 
     similarity_scores = calculate_similarity(
-        media_title, media_overview, recs_to_compare
+        media_id, media_type, media_title, media_overview, recs_to_compare
     )
 
-    for i, rec in enumerate(recs_to_compare):
-        text_sim = similarity_scores[i]
-        rec_media_info = get_media_details(rec.get("id"), rec.get("media_type"))
-
-        # For the movie candidate, remove if their languages don't match
-        if (
-            rec_media_info.get("original_language") != media_language
-            and rec_media_info.get("media_type") == "movie"
-        ):
-            continue
-
-        key = "keywords" if rec.get("media_type") == "movie" else "results"
-        rec_keywords = [
-            k["id"] for k in rec_media_info.get("keywords", []).get(key, [])
-        ] or []  # Keywords is double nested in the response.
-
-        rec_genres = [r.get("id") for r in rec_media_info.get("genres")] or []
-
-        # Genre similarity check
-        # Jaccard Similarity = |Intersection| / |Union|
-        # Intersection is the elements that appear in both
-        # Union is all the elements
-        if not media_genre_ids or not rec_genres:
-            genre_sim = 0.1
-        else:
-            common_genres = set(media_genre_ids).intersection(set(rec_genres))
-            total_genres = set(media_genre_ids).union(set(rec_genres))
-            genre_sim = len(common_genres) / len(total_genres) if total_genres else 0
-            if common_genres:
-                min_score = min(0.2 + (len(common_genres) * 0.1), 0.6)
-                genre_sim = max(genre_sim, min_score)
-
-        if media_keyword_ids and rec_keywords:  # Keyword similarity check
-            common_keywords = set(media_keyword_ids).intersection(set(rec_keywords))
-            total_keywords = set(media_keyword_ids).union(set(rec_keywords))
-            keyword_sim = (
-                len(common_keywords) / len(total_keywords) if total_keywords else 0
-            )
-            if common_keywords:
-                keyword_sim = max(keyword_sim, 0.3)
-        else:
-            keyword_sim = 0
-
-        genre_sim = min(genre_sim, 1.0)
-        text_sim = min(text_sim, 1.0)
-        keyword_sim = min(keyword_sim, 1.0)
-        popularity_factor = min(rec_media_info.get("popularity", 0) / 100, 1.0)
-
-        total_score = (
-            (genre_sim * 0.35)  # Genre importance: 35%
-            + (text_sim * 0.30)  # Text similarity importance: 30%
-            + (keyword_sim * 0.25)  # Keyword importance: 25%
-            + (popularity_factor * 0.10)  # Popularity importance: 10%
-        )
-
-        total_score = min(total_score * 10, 10)
-
-        filtered_recs.append(  # Recommendations are given weight based on importance
-            {"rec": rec, "score": total_score}
-        )
+    # Features for the whole pool at once. Only titles the store doesn't have yet are fetched, all at the same time
+    features_by_rec = feature_store.get_many(
+        [(rec.get("media_type"), rec.get("id")) for rec in recs_to_compare],
+        fetch_candidate_features,
+    )
 
-    filtered_recs = sorted(filtered_recs, key=lambda x: -x["score"])
-    results = [item["rec"] for item in filtered_recs[:24]]
+    # A title whose fetch failed is scored with what the discover result has
+    rec_features = [
+        features_by_rec.get((rec.get("media_type"), rec.get("id")))
+        or {
+            "genre_ids": unique_ids(rec.get("genre_ids", [])),
+            "keyword_ids": (),
+            "original_language": rec.get("original_language"),
+            "popularity": rec.get("popularity", 0),
+        }
+        for rec in recs_to_compare
+    ]
+    # Genre, keyword, text and popularity scores for the whole pool at once, then the best 24
+    best, _ = score_candidates(
+        media_genre_ids,
+        media_keyword_ids,
+        rec_features,
+        similarity_scores,
+        k=24,
+    )
+    results = [recs_to_compare[i] for i in best]
     if results:
         return jsonify({"recommendations": results or []})
     else:
@@ -580,50 +541,15 @@ def get_user_recommendations():
         ]
 
         if "all" not in platform_list:
-            all_platform_ids = set()
-            for platform in platform_list:
-                platform_ids = PLATFORM_ID_MAP.get(platform.lower(), [])
-                all_platform_ids.update(platform_ids)
-
-            filtered_movies = []
-            movie_slice = filtered_movie_results[:24]
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                # Map each movie to a future that fetches its providers
-                future_to_movie = {
-                    executor.submit(get_watch_providers, movie["id"], "movie"): i
-                    for i, movie in enumerate(movie_slice)
-                }
-                for future in as_completed(future_to_movie):
-                    i = future_to_movie[future]
-                    try:
-                        provider_ids = future.result(timeout=5)
-                        # Check if any provider matches any platform ID
-                        if any(pid in all_platform_ids for pid in provider_ids):
-                            filtered_movies.append(movie_slice[i])
-                    except Exception as e:
-                        print(f"Provider fetch failed for movie: {e}")
-
-            filtered_movie_results = filtered_movies
-
-            filtered_tv = []
-            tv_slice = filtered_tv_results[:24]
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                # Map each TV show to a future that fetches its providers
-                future_to_tv = {
-                    executor.submit(get_watch_providers, tv["id"], "tv"): i
-                    for i, tv in enumerate(tv_slice)
-                }
-                # Process results as they complete
-                for future in as_completed(future_to_tv):
-                    i = future_to_tv[future]
-                    try:
-                        provider_ids = future.result(timeout=5)
-                        if any(pid in all_platform_ids for pid in provider_ids):
-                            filtered_tv.append(tv_slice[i])
-                    except Exception as e:
-                        print(f"Provider fetch failed for TV show: {e}")
-
-            filtered_tv_results = filtered_tv
+            all_platform_ids = get_platform_ids(platform_list)
+
+            # Only the top 24 of each are checked. The lookups go through the shared provider engine
+            filtered_movie_results = filter_by_platforms(
+                filtered_movie_results[:24], "movie", all_platform_ids
+            )
+            filtered_tv_results = filter_by_platforms(
+                filtered_tv_results[:24], "tv", all_platform_ids
+            )
 
         sorted_movie_results = sorted(
             filtered_movie_results, key=lambda x: x.get("popularity", 0), reverse=True
@@ -1,14 +1,37 @@
 # Written By Moses Pierre
-from flask import Blueprint, request, jsonify
-import requests
+from flask import (
+    Blueprint,
+    request,
+    jsonify,
+    Response,
+    stream_with_context,
+    copy_current_request_context,
+    current_app,
+)
 import tmdbsimple as tmdb  # Library that makes interacting with TMDB API simplier
 from app.extensions import cache, limiter, get_watchmode_key
-import datetime
+from app.upstream import upstream_session
+from app.provider_lookup import provider_engine
+from app.availability_index import availability_index, PROVIDER_TYPES
+from app.relevance import rank_by_relevance
+from app.suggest_index import suggest_index
+from app.watchmode_ids import watchmode_id_map, load_mapping_on_startup
+from app.view_cache import swr_cached, swr_memoize, is_refreshing
+from app.etags import with_etag
+from app.projection import (
+    project,
+    with_fields_param,
+    SEARCH_RESULT_FIELDS,
+    DETAILS_FIELDS,
+    WATCHMODE_SOURCE_FIELDS,
+)
+from app.watchmode_quota import watchmode_quota, SOURCE_TTLS, STALE, TMDB_ONLY
+from app.negative_cache import NegativeCache, UpstreamError, UpstreamNotFound
+import queue
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# Simple rate limiter that keeps count of the function calls and thus api calls.
-from ratelimit import limits, sleep_and_retry
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
 
 search_bp = Blueprint("search", __name__)
@@ -24,6 +47,9 @@ def on_rate_limit_breach(request_limit):
 # Saves the watchmode API to a variable
 api_key = get_watchmode_key()
 
+# Bulk loads the TMDB to Watchmode id table if PY_WATCHMODE_ID_MAP is set and the table is empty
+load_mapping_on_startup()
+
 
 def make_search_cache_key():
     query = request.args.get("query", "").lower().strip()
@@ -34,6 +60,38 @@ def make_search_cache_key():
     return key_data
 
 
+# Seconds a request will wait on the provider engine before giving up on the remaining lookups
+PROVIDER_LOOKUP_TIMEOUT = 8
+
+# How many results a search tries to end up with after filtering (per media type)
+SEARCH_TARGET_RESULTS = 20
+# Most TMDB search pages a single search will read
+MAX_SEARCH_PAGES = 5
+# How many extra pages are fetched at the same time
+PAGE_FANOUT = 2
+# No new pages are started after this many seconds. The search view waits 15 seconds at most
+SEARCH_PAGES_DEADLINE = 10
+
+# Shared pool for the extra TMDB calls a request fans out (search pages, season chunks)
+tmdb_executor = ThreadPoolExecutor(max_workers=4)
+
+# Seconds /details waits on watchmode (counted from the start of the request) before answering without it
+DETAILS_DEADLINE = 3
+# Pool for the watchmode lookups that run next to the TMDB details call
+details_executor = ThreadPoolExecutor(max_workers=8)
+# Watchmode lookups that are still running, so a follow up request waits on them instead of calling again
+watchmode_futures = {}
+watchmode_futures_lock = threading.Lock()
+
+# Negative entries for titles the upstream doesn't have or that are failing
+provider_negatives = NegativeCache(cache, "providers")
+watchmode_negatives = NegativeCache(cache, "watchmode")
+
+# TMDB allows up to 20 items in one append_to_response
+APPEND_TO_RESPONSE_LIMIT = 20
+# Seasons are cached for a week. The cache key changes when a season gets new episodes
+SEASON_CACHE_TIMEOUT = 7 * 86400
+
 # TMDB STREAMING PLATFORM MAP
 PLATFORM_ID_MAP = {
     "netflix": [8, 1796, 175],
@@ -49,103 +107,221 @@ PLATFORM_ID_MAP = {
 }
 
 
-# Function that gets the watchproviders for media using id and type
+# Makes the direct /watch/providers call and saves the response in the availability index
 # I ran into a problem here where tmdbsimple wrapper was giving None responses
 # The wrapper is supposed to give an error message or something. None means that something is wrong with the wrapper
-# To combat this im using a call directly to the api if None is given as a response
+# To combat this im using a call directly to the api
+# Returns the providers by region. Raises UpstreamNotFound/UpstreamError so failures are never cached as "no providers"
+def fetch_provider_data(media_id, media_type):
+    print(f"Attempting direct API call")
+    api_key = tmdb.API_KEY
+    url = f"https://api.themoviedb.org/3/{media_type}/{media_id}/watch/providers?api_key={api_key}"
+    response = upstream_session.get(url)
+    if response.status_code == 404:
+        raise UpstreamNotFound(f"TMDB doesn't know {media_type} ID {media_id}")
+    if response.status_code != 200:
+        raise UpstreamError(f"Direct API call failed: {response.status_code}")
+
+    providers = response.json()
+    print(f"Direct API response successful")
+    if providers is None:
+        raise UpstreamError(
+            f"No provider data available for {media_type} ID {media_id}"
+        )
+
+    provider_data = providers.get("results", {})
+    # Every response we pay for goes into the index so later platform filters don't have to ask again
+    availability_index.record(media_type, media_id, provider_data)
+    return provider_data
+
+
+# Gets the US provider ids. Only real answers are memoized, errors raise and skip the cache
+# The TMDB rate limit is handled by the shared rate budget in the upstream session
+@swr_memoize(soft_ttl=3600, hard_ttl=86400)
+def fetch_watch_providers(media_id, media_type):
+    provider_data = fetch_provider_data(media_id, media_type)
+
+    # Extract US providers
+    us_providers = provider_data.get("US", {})
+
+    # For deduplication
+    provider_ids = set()
+    for provider_type in PROVIDER_TYPES:
+        for provider in us_providers.get(provider_type, []):
+            provider_id = provider.get("provider_id")
+            if provider_id:
+                provider_ids.add(provider_id)
+
+    # Returns the numeric id for watch providers
+    return list(provider_ids)
+
+
+# Function that gets the watchproviders for media using id and type
 # Executed by the thread
-@sleep_and_retry
-@limits(calls=50, period=5)
-@cache.memoize(3600)
+# Titles with a negative entry (unknown to TMDB or failing recently) return [] without calling TMDB
 def get_watch_providers(media_id, media_type):
+    key = f"{media_type}-{media_id}"
+    if provider_negatives.is_negative(key):
+        return []
     try:
-        # Direct API call, tmdbsimple limitation
-        # I was getting None responses
-        print(f"Attempting direct API call")
-        api_key = tmdb.API_KEY
-        url = f"https://api.themoviedb.org/3/{media_type}/{media_id}/watch/providers?api_key={api_key}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            providers = response.json()
-            print(f"Direct API response successful")
-        else:
-            print(f"Direct API call failed: {response.status_code}")
-            return []
+        provider_ids = fetch_watch_providers(media_id, media_type)
+        provider_negatives.record_success(key)
+        return provider_ids
+    except UpstreamNotFound as e:
+        print(e)
+        provider_negatives.record_missing(key)
+        return []
+    except Exception as e:
+        backoff = provider_negatives.record_failure(key)
+        print(f"Error fetching providers: {e}. Retrying in {backoff}s at the earliest")
+        return []
 
-        if providers is None:
-            print(f"No provider data available for {media_type} ID {media_id}")
-            return []
 
-        # Extract US providers
-        provider_data = providers.get("results", {})
-        us_providers = provider_data.get("US", {})
+# Keeps the availability index fresh in the background
+availability_index.start_refresher(fetch_provider_data)
 
-        if not us_providers:
-            return []
 
-        # For deduplication
-        provider_ids = set()
-        for provider_type in ["flatrate", "buy", "rent"]:
-            for provider in us_providers.get(provider_type, []):
-                provider_id = provider.get("provider_id")
-                if provider_id:
-                    provider_ids.add(provider_id)
+# Turns a list of platform names from the frontend into a set of TMDB provider ids
+def get_platform_ids(platform_list):
+    all_platform_ids = set()
+    for platform in platform_list:
+        platform_ids = PLATFORM_ID_MAP.get(platform.lower(), [])
+        all_platform_ids.update(platform_ids)
+    return all_platform_ids
 
-        return list(provider_ids)
 
-        # Returns the numeric id for watch providers
-    except Exception as e:
-        print(f"Error fetching providers: {e}")
-        return []
+# Keeps only the items available on at least one of the platforms
+# Titles already in the availability index are answered in memory
+# Only the unknown ones are looked up, on the shared provider engine instead of a new thread pool per search
+# Items whose lookup doesn't finish before the deadline are left out
+# on_match is optional and gets called with each batch of matches as soon as they're known (used by streaming search)
+def filter_by_platforms(
+    items, media_type, platform_ids, timeout=PROVIDER_LOOKUP_TIMEOUT, on_match=None
+):
+    available, unknown = availability_index.filter(items, media_type, platform_ids)
+    available_ids = {item["id"] for item in available}
+    if on_match and available:
+        on_match(available)
+
+    items_by_id = {item["id"]: item for item in unknown}
+
+    # Called by the engine's worker threads as each lookup finishes
+    def on_result(item_id, provider_ids):
+        if on_match and any(pid in platform_ids for pid in provider_ids):
+            on_match([items_by_id[item_id]])
+
+    tasks = [(item["id"], (item["id"], media_type)) for item in unknown]
+    provider_results = provider_engine.run(
+        tasks, get_watch_providers, timeout=timeout, on_result=on_result
+    )
+    for item_id, provider_ids in provider_results.items():
+        if any(pid in platform_ids for pid in provider_ids):
+            available_ids.add(item_id)
+
+    # Keeps the original TMDB order
+    return [item for item in items if item["id"] in available_ids]
+
+
+# Gets one page of TMDB search results. kind is "movie", "tv" or "multi"
+# Each page is cached on its own so deeper pages fetched for one filter are reused by the next search
+@swr_memoize(soft_ttl=3600, hard_ttl=86400)
+def search_page(kind, query, page):
+    response = getattr(tmdb.Search(), kind)(query=query, page=page)
+    results = []
+    for item in response.get("results", []):
+        # Multi search already says what each result is. Movie and tv searches don't
+        item.setdefault("media_type", kind)
+        # Only the fields we use are kept (and cached)
+        results.append(project(item, SEARCH_RESULT_FIELDS))
+    return {"results": results, "total_pages": response.get("total_pages", 1)}
+
+
+# Without a platform filter nothing gets thrown away so page 1 is enough
+def get_max_pages(streaming_platform):
+    return 1 if streaming_platform == "all" else MAX_SEARCH_PAGES
+
+
+# SEARCH FAN OUT
+# Reads page 1 and only goes deeper when the filter threw away too many results
+# Extra pages are fetched PAGE_FANOUT at a time and it stops as soon as the target is met
+# keep_fn takes a page of results and returns the ones that pass the filters
+# on_kept is called with each page's kept results right away, so a caller that stops waiting still has them
+def fetch_search_pages(
+    kind, query, keep_fn, target, on_kept, max_pages=MAX_SEARCH_PAGES
+):
+    deadline = time.monotonic() + SEARCH_PAGES_DEADLINE
+    kept = []
+    seen = set()
+
+    def add_page(results):
+        # Pages can overlap when TMDB reorders results between calls
+        new_items = []
+        for item in results:
+            key = (item.get("media_type"), item.get("id"))
+            if key not in seen:
+                seen.add(key)
+                new_items.append(item)
+        suggest_index.add_items(new_items)
+        page_kept = keep_fn(new_items)
+        kept.extend(page_kept)
+        on_kept(page_kept)
+
+    first_page = search_page(kind, query, 1)
+    add_page(first_page["results"])
+    last_page = min(first_page["total_pages"], max_pages)
+
+    page = 2
+    while len(kept) < target and page <= last_page and time.monotonic() < deadline:
+        pages = range(page, min(page + PAGE_FANOUT, last_page + 1))
+        futures = [
+            tmdb_executor.submit(search_page, kind, query, number) for number in pages
+        ]
+        # Goes through the pages in order so the best TMDB matches are kept first
+        for future in futures:
+            if len(kept) >= target:
+                future.cancel()
+                continue
+            try:
+                add_page(future.result(timeout=10)["results"])
+            except Exception as e:
+                print(f"Error fetching search page: {e}")
+        page += PAGE_FANOUT
+    return kept
+
+
+# Builds the keep_fn for one media type
+# Drops results of other types (multi search) and applies the streaming platform filter if there is one
+# on_items is optional and is called with results as soon as they're ready
+def make_page_filter(media_type, streaming_platform, on_items=None):
+    platform_ids = None
+    if streaming_platform != "all":
+        platform_ids = get_platform_ids(streaming_platform.split(","))
+
+    def keep(items):
+        items = [item for item in items if item.get("media_type") == media_type]
+        if platform_ids is None:
+            if on_items and items:
+                on_items(items)
+            return items
+        return filter_by_platforms(items, media_type, platform_ids, on_match=on_items)
+
+    return keep
 
 
 # Serperate thread executed function to handle movie search
-def process_movies(query, streaming_platform, movie_results, movies_done):
+def process_movies(
+    query, streaming_platform, movie_results, movies_done, on_items=None
+):
     try:
-        movie_search = tmdb.Search()
-        movie_search.movie(query=query)
-
-        all_movies = []
-        for item in movie_search.results:
-            item["media_type"] = "movie"
-            all_movies.append(item)
-
-        if streaming_platform != "all":
-            platform_list = (
-                streaming_platform.split(",")
-                if streaming_platform != "all"
-                else ["all"]
-            )
-            all_platform_ids = set()
-            for platform in platform_list:
-                platform_ids = PLATFORM_ID_MAP.get(platform.lower(), [])
-                all_platform_ids.update(platform_ids)
-
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                # Using threadpoolexecutor, the return are futures that can be worked with
-                # This is created a pool of threads to perform the defined function with the args
-                # Just a reminder for myself that enumerate returns a tuple of iterator and value
-                # This syntax creates a dictionary in python
-                # The key here is the future objects and the values are the indices of each movie in the list
-                # Future objects are held as memory addresses so they're unique
-                # In short future:(movie_index:movie_value)
-                future_to_movie = {
-                    executor.submit(get_watch_providers, movie["id"], "movie"): i
-                    for i, movie in enumerate(all_movies)
-                }
-                # as_completed gets the futures as they complete
-                for future in as_completed(future_to_movie):
-                    # This works because I set the future object as a key in the line above
-                    # It returns the index of the movie in all_movies
-                    i = future_to_movie[future]
-                    try:
-                        provider_ids = future.result(timeout=5)
-                        if any(pid in all_platform_ids for pid in provider_ids):
-                            movie_results.append(all_movies[i])
-                    except Exception as e:
-                        print(f"Fetching Provider failed: {e}")
-        else:
-            movie_results.extend(all_movies)
+        keep = make_page_filter("movie", streaming_platform, on_items)
+        fetch_search_pages(
+            "movie",
+            query,
+            keep,
+            SEARCH_TARGET_RESULTS,
+            movie_results.extend,
+            get_max_pages(streaming_platform),
+        )
     except Exception as e:
         print(f"Error in movie processing thread: {e}")
     finally:
@@ -154,44 +330,17 @@ def process_movies(query, streaming_platform, movie_results, movies_done):
 
 
 # Serperate thread executed function to handle tv search
-def process_tv_shows(query, streaming_platform, tv_results, tv_done):
+def process_tv_shows(query, streaming_platform, tv_results, tv_done, on_items=None):
     try:
-        tv_search = tmdb.Search()
-        tv_search.tv(query=query)
-        all_tv = []
-        for item in tv_search.results:
-            item["media_type"] = "tv"
-            all_tv.append(item)
-
-        if streaming_platform != "all":
-            platform_list = (
-                streaming_platform.split(",")
-                if streaming_platform != "all"
-                else ["all"]
-            )
-            all_platform_ids = set()
-            for platform in platform_list:
-                platform_ids = PLATFORM_ID_MAP.get(platform.lower(), [])
-                all_platform_ids.update(platform_ids)
-
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                future_to_tv = {
-                    executor.submit(get_watch_providers, tv["id"], "tv"): i
-                    for i, tv in enumerate(all_tv)
-                }
-                # as_completed gets the futures as they complete
-                for future in as_completed(future_to_tv):
-                    # This works because I set the future object as a key in the line above
-                    # It returns the index of the movie in all_movies
-                    i = future_to_tv[future]
-                    try:
-                        provider_ids = future.result(timeout=5)
-                        if any(pid in all_platform_ids for pid in provider_ids):
-                            tv_results.append(all_tv[i])
-                    except Exception as e:
-                        print(f"Fetching Provider failed: {e}")
-        else:
-            tv_results.extend(all_tv)
+        keep = make_page_filter("tv", streaming_platform, on_items)
+        fetch_search_pages(
+            "tv",
+            query,
+            keep,
+            SEARCH_TARGET_RESULTS,
+            tv_results.extend,
+            get_max_pages(streaming_platform),
+        )
     except Exception as e:
         print(f"Error in tv processing thread: {e}")
     finally:
@@ -199,74 +348,60 @@ def process_tv_shows(query, streaming_platform, tv_results, tv_done):
         tv_done.set()
 
 
-# FUNCTION FOR CALCULATING RELEVANCE FOR SEARCH RESULT SORTING
-def calculate_relevance(item, query):
-    title = item.get("title", "") or item.get("name", "")
-
-    if not title:
-        return 0
-
-    if (
-        item.get("popularity") < 3 and item.get("vote_count") < 20
-    ):  # If its been released and its not popular and doesn't have a lot of votes put on the bottom
-        return 0
-    # Makes sure that items with the query in the name get precidence
-    title = item.get("title", "") or item.get("name", "")
-
-    base_score = item.get("popularity", 0)
-
-    # Split query into words for partial matching
-    query_words = query.lower().split()
-
-    # Calculates title match score
-    title_match_score = 0
-
-    # Exact matches gets highest priority
-    if title.lower() == query.lower():
-        title_match_score = 10
-
-    # Partial matches where query is contained in title
-    elif query.lower() in title.lower():
-        title_match_score = 5
-    # Check for individual word matches
-    else:
-        word_matches = sum(1 for word in query_words if word in title.lower())
-        if word_matches > 0:
-            title_match_score = 2 * word_matches
-
-    # Consider release date for recency
-    release_date_score = 0
-    release_date = item.get("release_date") or item.get("first_air_date")
-    if release_date:
-        try:
-            year = int(release_date[:4])
-            current_year = datetime.datetime.now().year
-            years_old = current_year - year
-            release_date_score = max(
-                0, 1 - (years_old / 10)
-            )  # Newer content scores higher
-        except:
-            pass
-
-    # Vote average
-    vote_avg_score = item.get("vote_average", 0) / 10
-
-    # Calculate final score with title matches having higher weight than popularity
-    final_score = (
-        (title_match_score * 100)  # Title match has highest weight
-        + (release_date_score * 20)  # Recency has medium weight
-        + (vote_avg_score * 15)  # Rating quality has medium weight
-        + (base_score * 10)  # Popularity has lower weight
-    )
+# Serperate thread executed function for filter_type=all with a platform filter
+# One multi search page has both movies and tv shows so deeper pages take half the TMDB calls of running both
+# searches. The movie and tv platform filters for a page run at the same time
+def process_multi(
+    query,
+    streaming_platform,
+    movie_results,
+    tv_results,
+    movies_done,
+    tv_done,
+    on_movies=None,
+    on_tv=None,
+):
+    try:
+        keep_movies = make_page_filter("movie", streaming_platform, on_movies)
+        keep_tv = make_page_filter("tv", streaming_platform, on_tv)
 
-    return final_score
+        def keep(items):
+            kept_movies = []
+            movie_thread = threading.Thread(
+                target=lambda: kept_movies.extend(keep_movies(items))
+            )
+            movie_thread.daemon = True
+            movie_thread.start()
+            kept_tv = keep_tv(items)
+            movie_thread.join()
+            return kept_movies + kept_tv
+
+        def add_results(results):
+            movie_results.extend(r for r in results if r["media_type"] == "movie")
+            tv_results.extend(r for r in results if r["media_type"] == "tv")
+
+        fetch_search_pages(
+            "multi",
+            query,
+            keep,
+            SEARCH_TARGET_RESULTS * 2,
+            add_results,
+            get_max_pages(streaming_platform),
+        )
+    except Exception as e:
+        print(f"Error in multi search thread: {e}")
+    finally:
+        movies_done.set()
+        tv_done.set()
 
 
 # What happens when someone visits the /search endpoint of this Flask API
 @search_bp.route("/", methods=["GET"])
 # Initializes cache for view function
 @limiter.limit("50 per 5 seconds")
-@cache.cached(query_string=True, make_cache_key=make_search_cache_key)
+@with_fields_param
+# Streamed responses aren't cached here. stream_search saves the full version itself
+@swr_cached(soft_ttl=86400, hard_ttl=3 * 86400, make_cache_key=make_search_cache_key)
 def search():
     # Gets query variable passed from React
     query = request.args.get("query").lower().strip()
@@ -282,77 +417,226 @@ def search():
         return jsonify({"test_results": "Successful Test"})
     else:
         try:
+            # Streaming mode sends results as they come in instead of waiting on the slowest branch
+            # A background refresh has nobody to stream to so it builds the normal response
+            if request.args.get("stream") == "1" and not is_refreshing():
+                return stream_search(query, filter_type, streaming_platform)
+
             movie_results = []
             tv_results = []
-            # Thread event flags
-            movies_done = threading.Event()
-            tv_done = threading.Event()
-            # Starts the threads based on the filter
-            if filter_type == "all" or filter_type == "movie":
-                movie_thread = threading.Thread(
-                    target=process_movies,
-                    args=(query, streaming_platform, movie_results, movies_done),
-                )
-                movie_thread.daemon = True
-                movie_thread.start()
-            else:
-                movies_done.set()
-
-            if filter_type == "all" or filter_type == "tv":
-                tv_thread = threading.Thread(
-                    target=process_tv_shows,
-                    args=(query, streaming_platform, tv_results, tv_done),
-                )
-                tv_thread.daemon = True
-                tv_thread.start()
-            else:
-                tv_done.set()
+            movies_done, tv_done = start_search_threads(
+                query, filter_type, streaming_platform, movie_results, tv_results
+            )
 
             movies_done.wait(timeout=15)
             tv_done.wait(timeout=15)
             # Gather the results and return to frontend
-            if filter_type == "all":
-                all_results = []
+            return jsonify(
+                build_search_response(query, filter_type, movie_results, tv_results)
+            )
 
-                for item in movie_results:
-                    relavance = calculate_relevance(item, query)
-                    all_results.append({"item": item, "relevance": relavance})
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
 
-                for item in tv_results:
-                    relavance = calculate_relevance(item, query)
-                    all_results.append({"item": item, "relevance": relavance})
 
-                all_results = sorted(
-                    all_results, key=lambda x: x["relevance"], reverse=True
-                )
+# STREAMING SEARCH
+# Sends newline delimited JSON. Each line is one record:
+#   {"type": "results", "media_type": "movie", "results": [...]} whenever a branch or provider check finishes
+#   {"type": "summary", ...} last, with the same ranked body the normal endpoint returns
+# The full response is saved under the normal search cache key so the next request is a regular cache hit
+def stream_search(query, filter_type, streaming_platform):
+    cache_key = make_search_cache_key()
+    updates = queue.Queue()
+    movie_results = []
+    tv_results = []
+    movies_done, tv_done = start_search_threads(
+        query,
+        filter_type,
+        streaming_platform,
+        movie_results,
+        tv_results,
+        on_movies=lambda items: updates.put(("movie", items)),
+        on_tv=lambda items: updates.put(("tv", items)),
+    )
 
-                final_results = [result["item"] for result in all_results]
-
-                return jsonify({"results": final_results or []})
-            elif filter_type == "movie":
-                movie_results = sorted(
-                    movie_results,
-                    key=lambda x: calculate_relevance(x, query),
-                    reverse=True,
-                )  # Sorts all results in order of popularity via popularity key.
-
-                return jsonify({"tmdb_movie": movie_results or []})
-            elif filter_type == "tv":
-                tv_results = tv_results = sorted(
-                    tv_results,
-                    key=lambda x: calculate_relevance(x, query),
-                    reverse=True,
-                )
-                return jsonify({"tmdb_tv": tv_results or []})
+    def generate():
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            try:
+                media_type, items = updates.get(timeout=0.1)
+            except queue.Empty:
+                if movies_done.is_set() and tv_done.is_set() and updates.empty():
+                    break
+                continue
+            record = {"type": "results", "media_type": media_type, "results": items}
+            yield current_app.json.dumps(record) + "\n"
+
+        summary = build_search_response(query, filter_type, movie_results, tv_results)
+        yield current_app.json.dumps({"type": "summary", **summary}) + "\n"
+        # Saves the materialized version for the non streaming endpoint
+        search.store(cache_key, jsonify(summary))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+# Starts the movie and tv threads based on the filter and returns their done events
+def start_search_threads(
+    query,
+    filter_type,
+    streaming_platform,
+    movie_results,
+    tv_results,
+    on_movies=None,
+    on_tv=None,
+):
+    # Thread event flags
+    movies_done = threading.Event()
+    tv_done = threading.Event()
+    # Without a platform filter "all" runs the movie and tv searches like before
+    # One multi search page only has about half as many results as page 1 of both
+    if filter_type == "all" and streaming_platform != "all":
+        multi_thread = threading.Thread(
+            target=process_multi,
+            args=(
+                query,
+                streaming_platform,
+                movie_results,
+                tv_results,
+                movies_done,
+                tv_done,
+                on_movies,
+                on_tv,
+            ),
+        )
+        multi_thread.daemon = True
+        multi_thread.start()
+        return movies_done, tv_done
+
+    if filter_type == "all" or filter_type == "movie":
+        movie_thread = threading.Thread(
+            target=process_movies,
+            args=(query, streaming_platform, movie_results, movies_done, on_movies),
+        )
+        movie_thread.daemon = True
+        movie_thread.start()
+    else:
+        movies_done.set()
 
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+    if filter_type == "all" or filter_type == "tv":
+        tv_thread = threading.Thread(
+            target=process_tv_shows,
+            args=(query, streaming_platform, tv_results, tv_done, on_tv),
+        )
+        tv_thread.daemon = True
+        tv_thread.start()
+    else:
+        tv_done.set()
+
+    return movies_done, tv_done
+
+
+# Ranks the results and builds the body the frontend expects for each filter
+# Scoring is done for the whole list at once by rank_by_relevance
+def build_search_response(query, filter_type, movie_results, tv_results):
+    if filter_type == "all":
+        final_results = rank_by_relevance(movie_results + tv_results, query)
+        return {"results": final_results or []}
+    elif filter_type == "movie":
+        movie_results = rank_by_relevance(movie_results, query)
+        return {"tmdb_movie": movie_results or []}
+    elif filter_type == "tv":
+        tv_results = rank_by_relevance(tv_results, query)
+        return {"tmdb_tv": tv_results or []}
+    return {"error": f"Unknown filter type: {filter_type}"}
+
+
+# TYPEAHEAD SUGGESTIONS
+# Answers from the local prefix index so typing in the search box doesn't hit TMDB on every keystroke
+@search_bp.route("/suggest", methods=["GET"])
+@limiter.limit("100 per 5 seconds")
+def suggest():
+    query = request.args.get("query", "")
+    try:
+        limit = min(int(request.args.get("limit", 8)), 20)
+    except ValueError:
+        limit = 8
+
+    return jsonify({"suggestions": suggest_index.suggest(query, limit=limit)})
+
+
+# Gets detailed information from TMDB using append_to_response. Saves on quota
+def fetch_tmdb_details(item_id, item_type):
+    media = tmdb.Movies(item_id) if item_type == "movie" else tmdb.TV(item_id)
+    get_ratings = "release_dates" if item_type == "movie" else "content_ratings"
+    tmdb_details = media.info(
+        append_to_response=f"keywords,credits,videos,images,{get_ratings}"
+    )
+
+    tmdb_details["media_type"] = (
+        item_type  # Saves item type to item since info() doesn't give it
+    )
+    suggest_index.add_items([tmdb_details])
+    # Response for movie and show keywords is different
+    if "keywords" in tmdb_details:
+        key = "keywords" if item_type == "movie" else "results"
+        tmdb_details["keywords"] = tmdb_details["keywords"].get(key, [])
+
+    if item_type == "tv":
+        content_ratings = tmdb_details.get("content_ratings", {})
+        results = content_ratings.get("results", [])
+        for item in results:
+            if item.get("iso_3166_1") == "US":
+                tmdb_details["content_rating"] = item.get("rating")
+                break
+    elif item_type == "movie":
+        release_dates = tmdb_details.get("release_dates", {})
+        results = release_dates.get("results", [])
+        for item in results:
+            if item.get("iso_3166_1") == "US":
+                release_dates_list = item.get("release_dates", [])
+                if release_dates_list and len(release_dates_list) > 0:
+                    tmdb_details["content_rating"] = release_dates_list[0].get(
+                        "certification", ""
+                    )
+                    break
+    # Drops what the detail modal doesn't show (crew, ratings for every country, image sizes...)
+    return project(tmdb_details, DETAILS_FIELDS)
+
+
+# Starts the watchmode lookup in the background
+# If the same title is already being looked up the running future is reused instead of calling watchmode again
+def start_watchmode_search(item_id, item_type):
+    key = (str(item_id), item_type)
+    with watchmode_futures_lock:
+        future = watchmode_futures.get(key)
+        if future is None:
+            # The limiter on watchmode_search needs the request context in the worker thread
+            future = details_executor.submit(
+                copy_current_request_context(watchmode_search), item_id, item_type
+            )
+            watchmode_futures[key] = future
+
+            def forget(_):
+                with watchmode_futures_lock:
+                    watchmode_futures.pop(key, None)
+
+            future.add_done_callback(forget)
+    return future
+
+
+# Details responses are only cached once watchmode has answered
+def is_complete_details(rv):
+    return isinstance(rv, Response) and "X-Watchmode-Pending" not in rv.headers
 
 
 # Search/details enpoint (this handles the extra data given when you click a result)
+# TMDB and watchmode run at the same time. TMDB is required for the modal.
+# Watchmode is only waited on until the shared deadline, after that the response says watchmode_pending
+# and the frontend can get the sources from /search/details/watchmode
 @search_bp.route("/details", methods=["GET"])
 @limiter.limit("50 per 5 seconds")
-@cache.cached(query_string=True)
+@with_fields_param
+@swr_cached(soft_ttl=86400, hard_ttl=7 * 86400, response_filter=is_complete_details)
 def details():
     item_id = request.args.get("id")
     item_type = request.args.get("type")
@@ -363,57 +647,76 @@ def details():
 
     elif item_type == "movie" or item_type == "tv":
         try:
-            media = tmdb.Movies(item_id) if item_type == "movie" else tmdb.TV(item_id)
-            get_ratings = "release_dates" if item_type == "movie" else "content_ratings"
-            tmdb_details = media.info(
-                append_to_response=f"keywords,credits,videos,images,{get_ratings}"
-            )  # Gets detailed information from TMDB using append_to_response. Saves on quota
-
-            tmdb_details["media_type"] = (
-                item_type  # Saves item type to item since info() doesn't give it
-            )
-            # Response for movie and show keywords is different
-            if "keywords" in tmdb_details:
-                key = "keywords" if item_type == "movie" else "results"
-                tmdb_details["keywords"] = tmdb_details["keywords"].get(key, [])
-
-            if item_type == "tv":
-                content_ratings = tmdb_details.get("content_ratings", {})
-                results = content_ratings.get("results", [])
-                for item in results:
-                    if item.get("iso_3166_1") == "US":
-                        tmdb_details["content_rating"] = item.get("rating")
-                        break
-            elif item_type == "movie":
-                release_dates = tmdb_details.get("release_dates", {})
-                results = release_dates.get("results", [])
-                for item in results:
-                    if item.get("iso_3166_1") == "US":
-                        release_dates_list = item.get("release_dates", [])
-                        if release_dates_list and len(release_dates_list) > 0:
-                            tmdb_details["content_rating"] = release_dates_list[0].get(
-                                "certification", ""
-                            )
-                            break
-
-            watchmode_data = watchmode_search(
-                item_id, item_type
-            )  # Passes the tmdb_id and type to watchmode search function"
-
-            return jsonify(
-                {
-                    "tmdb": tmdb_details or [],
-                    "watchmode": watchmode_data or [],
-                }
-            )
+            deadline = time.monotonic() + DETAILS_DEADLINE
+            # Passes the tmdb_id and type to watchmode search function
+            watchmode_future = start_watchmode_search(item_id, item_type)
+            tmdb_details = fetch_tmdb_details(item_id, item_type)
+
+            body = {"tmdb": tmdb_details or []}
+            try:
+                body["watchmode"] = (
+                    watchmode_future.result(timeout=max(0, deadline - time.monotonic()))
+                    or []
+                )
+            except FuturesTimeoutError:
+                print(f"Watchmode still pending for {item_type} {item_id}")
+                body["watchmode"] = []
+                body["watchmode_pending"] = True
+            except Exception as e:
+                print(f"Watchmode search failed: {e}")
+                body["watchmode"] = []
+
+            response = jsonify(body)
+            if body.get("watchmode_pending"):
+                response.headers["X-Watchmode-Pending"] = "1"
+            return response
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
 
+# Watchmode sources on their own. Used after /details answered with watchmode_pending
+@search_bp.route("/details/watchmode", methods=["GET"])
+@limiter.limit("50 per 5 seconds")
+def details_watchmode():
+    item_id = request.args.get("id")
+    item_type = request.args.get("type")
+
+    if not item_id or item_type not in ("movie", "tv"):
+        return jsonify({"error": "Both id and type parameters are requred"}), 400
+
+    try:
+        watchmode_data = start_watchmode_search(item_id, item_type).result(timeout=15)
+        return jsonify({"watchmode": watchmode_data or []})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# The episode count and air date are part of the key so a season that changed (new episodes) is fetched again
+def make_season_cache_key(tv_id, season):
+    return f"tv-season-{tv_id}-{season.get('season_number')}-{season.get('episode_count')}-{season.get('air_date')}"
+
+
+# Gets the episodes for several seasons with one call using append_to_response=season/1,season/2,...
+# Seasons TMDB left out of the response (partial or failed) aren't in the returned dictionary
+def fetch_season_chunk(tv_id, season_numbers):
+    tv = tmdb.TV(tv_id)
+    tv_info = tv.info(
+        append_to_response=",".join(f"season/{n}" for n in season_numbers)
+    )
+    return {
+        n: tv_info[f"season/{n}"].get("episodes", [])
+        for n in season_numbers
+        if tv_info.get(f"season/{n}")
+    }
+
+
 # GET SEASON INFORMATION FOR TV SHOWS
+# One call for the show info, then only the seasons that aren't cached are fetched
+# They're fetched in chunks of 20 and the chunks run at the same time
 @search_bp.route("/tv/all_episodes", methods=["GET"])
 @limiter.limit("50 per 5 seconds")
-@cache.cached(query_string=True)
+@with_etag
+@cache.cached(query_string=True, timeout=3600)
 def get_all_tv_episodes():
     tv_id = request.args.get("id")
 
@@ -429,21 +732,66 @@ def get_all_tv_episodes():
         if len(seasons_data) > 0:
             seasons_data = [s for s in seasons_data if s.get("season_number") != 0]
 
-        # Getting the episodes for the season
+        # Getting the episodes for the season. Cached seasons are used as is
         episodes_by_season = {}
+        missing_seasons = []
         for season in seasons_data:
             season_number = season.get("season_number")
-            tv_seasons = tmdb.TV_Seasons(tv_id, season_number)
-            season_info = tv_seasons.info()
-            episodes_by_season[season_number] = season_info.get("episodes", [])
+            episodes = cache.get(make_season_cache_key(tv_id, season))
+            if episodes is None:
+                missing_seasons.append(season)
+            else:
+                episodes_by_season[season_number] = episodes
+
+        chunks = [
+            missing_seasons[i : i + APPEND_TO_RESPONSE_LIMIT]
+            for i in range(0, len(missing_seasons), APPEND_TO_RESPONSE_LIMIT)
+        ]
+        futures = [
+            (
+                chunk,
+                tmdb_executor.submit(
+                    fetch_season_chunk,
+                    tv_id,
+                    [season.get("season_number") for season in chunk],
+                ),
+            )
+            for chunk in chunks
+        ]
+        for chunk, future in futures:
+            chunk_episodes = future.result(timeout=15)
+            for season in chunk:
+                season_number = season.get("season_number")
+                episodes = chunk_episodes.get(season_number)
+                if episodes is None:
+                    # Only cached when TMDB sent it so the next request asks again
+                    episodes_by_season[season_number] = []
+                    continue
+                episodes_by_season[season_number] = episodes
+                cache.set(
+                    make_season_cache_key(tv_id, season),
+                    episodes,
+                    timeout=SEASON_CACHE_TIMEOUT,
+                )
+
+        # Keeps the seasons in order like before
+        episodes_by_season = {
+            season.get("season_number"): episodes_by_season[season.get("season_number")]
+            for season in seasons_data
+        }
         return jsonify({"seasons": seasons_data, "episodes": episodes_by_season})
     except Exception as e:
         return jsonify({"error": str(e)})
 
 
-@cache.memoize(3600)  # Initializes cache for function
-@limiter.limit("100 per minute", on_breach=on_rate_limit_breach)
-def watchmode_search(tmdb_id, type):  # Function takes tmdb id and type (movie or tv)
+# Turns a TMDB id into a Watchmode title id
+# The local mapping table is checked first. Only unknown ids cost a Watchmode /search/ call
+# Raises UpstreamNotFound when watchmode doesn't know the title and UpstreamError when the call failed
+def get_watchmode_title_id(tmdb_id, type):
+    title_id = watchmode_id_map.get(type, tmdb_id)
+    if title_id is not None:
+        return title_id
+
     url = f"{base_url}/search/"  # Endpoint url building
     search_field = "tmdb_movie_id" if type == "movie" else "tmdb_tv_id"
     params = {
@@ -452,46 +800,130 @@ def watchmode_search(tmdb_id, type):  # Function takes tmdb id and type (movie o
         "search_value": tmdb_id,
     }  # The value being passed
 
-    response = requests.get(url, params=params)  # Request made to API endpoint
-
-    if response.status_code == 200:  # Watchmode code 200 means request was successful
-        results = response.json().get("title_results", [])
-
-        # Iterates through the results given and gets data under ID key from results
-        if results and isinstance(results, list):
-            title_id = results[0].get("id")
-            sources_url = f"{base_url}/title/{title_id}/sources/"  # ID key used to query the sources endpoint
-            sources_params = {"apiKey": api_key}
-            sources_response = requests.get(sources_url, params=sources_params)
-
-            if sources_response.status_code == 200:
-                sources = sources_response.json()
-                us_sources = [
-                    source
-                    for source in sources
-                    if source.get("region", "").upper() == "US"
-                ]
-                unique_sources = []
-                seen = set()
-
-                for s in us_sources:
-                    key = (s.get("name"), s.get("type"), s.get("price"))
-                    if key not in seen:
-                        seen.add(key)
-                        unique_sources.append(s)
-                return sorted(
-                    unique_sources, key=lambda x: x["name"]
-                )  # If all is successful, dictionary of sources are returned
-            else:
-                print(
-                    f"Watchmode source API Error: {sources_response.status_code} - {sources_response.text}"
-                )
-                cache.delete_memoized(watchmode_search, tmdb_id, type)
-                return []
-        else:
-            cache.delete_memoized(watchmode_search, tmdb_id, type)
+    response = upstream_session.get(url, params=params)  # Request made to API endpoint
+    watchmode_quota.record_call(response)
+
+    if response.status_code != 200:  # Watchmode code 200 means request was successful
+        raise UpstreamError(
+            f"WatchMode API Error: {response.status_code} - {response.text}"
+        )
+
+    results = response.json().get("title_results", [])
+    # Gets data under ID key from the first result
+    title_id = results[0].get("id") if results and isinstance(results, list) else None
+    if not title_id:
+        raise UpstreamNotFound(f"Watchmode doesn't know {type} {tmdb_id}")
+    # Saves the mapping so this title never needs a search call again
+    watchmode_id_map.put(type, tmdb_id, title_id)
+    return title_id
+
+
+# Gets the US sources for a title
+# Caching is done by watchmode_search since how long sources are kept depends on the quota left
+# Failures raise so they aren't cached for an hour like they used to be
+@limiter.limit("100 per minute", on_breach=on_rate_limit_breach)
+def fetch_watchmode_sources(tmdb_id, type):
+    title_id = get_watchmode_title_id(tmdb_id, type)
+
+    sources_url = f"{base_url}/title/{title_id}/sources/"  # ID key used to query the sources endpoint
+    sources_params = {"apiKey": api_key}
+    sources_response = upstream_session.get(sources_url, params=sources_params)
+    watchmode_quota.record_call(sources_response)
+
+    if sources_response.status_code != 200:
+        raise UpstreamError(
+            f"Watchmode source API Error: {sources_response.status_code} - {sources_response.text}"
+        )
+
+    sources = sources_response.json()
+    us_sources = [
+        source for source in sources if source.get("region", "").upper() == "US"
+    ]
+    unique_sources = []
+    seen = set()
+
+    for s in us_sources:
+        key = (s.get("name"), s.get("type"), s.get("price"))
+        if key not in seen:
+            seen.add(key)
+            unique_sources.append(project(s, WATCHMODE_SOURCE_FIELDS))
+    return sorted(
+        unique_sources, key=lambda x: x["name"]
+    )  # If all is successful, dictionary of sources are returned
+
+
+# TMDB provider types and the watchmode source type they're shown as
+TMDB_SOURCE_TYPES = {
+    "flatrate": "sub",
+    "free": "free",
+    "ads": "free",
+    "buy": "buy",
+    "rent": "rent",
+}
+
+
+# Sources in the same shape as watchmode's built from TMDB's /watch/providers data
+# Used once the watchmode quota is nearly gone. TMDB only gives one link per title (its JustWatch page)
+@swr_memoize(soft_ttl=3600, hard_ttl=86400)
+def fetch_tmdb_sources(tmdb_id, type):
+    us_providers = fetch_provider_data(tmdb_id, type).get("US", {})
+    sources = []
+    for provider_type, source_type in TMDB_SOURCE_TYPES.items():
+        for provider in us_providers.get(provider_type, []):
+            sources.append(
+                {
+                    "name": provider.get("provider_name"),
+                    "type": source_type,
+                    "price": None,
+                    "region": "US",
+                    "web_url": us_providers.get("link"),
+                }
+            )
+    return sorted(sources, key=lambda x: x["name"] or "")
+
+
+# Function takes tmdb id and type (movie or tv)
+# How hard watchmode is used depends on how much of the monthly quota is left (see watchmode_quota.py)
+# Titles watchmode doesn't have and titles that failed recently return [] without calling watchmode
+def watchmode_search(tmdb_id, type):
+    key = f"{type}-{tmdb_id}"
+    level = watchmode_quota.get_level()
+    if level == TMDB_ONLY:
+        try:
+            return fetch_tmdb_sources(tmdb_id, type)
+        except Exception as e:
+            print(f"Error building sources from TMDB: {e}")
             return []
-    else:
-        print(f"WatchMode API Error: {response.status_code} - {response.text}")
-        cache.delete_memoized(watchmode_search, tmdb_id, type)
+
+    sources_key = f"watchmode-sources-{key}"
+    sources = cache.get(sources_key)
+    if sources is not None:
+        return sources
+    # Low on quota. Whatever we got last time is better than spending a call
+    if level == STALE:
+        sources = watchmode_quota.get_stale_sources(key)
+        if sources is not None:
+            return sources
+
+    if watchmode_negatives.is_negative(key):
+        return []
+    try:
+        sources = fetch_watchmode_sources(tmdb_id, type)
+        watchmode_negatives.record_success(key)
+        cache.set(sources_key, sources, timeout=SOURCE_TTLS[level])
+        watchmode_quota.save_sources(key, sources)
+        return sources
+    except UpstreamNotFound as e:
+        print(e)
+        watchmode_negatives.record_missing(key)
         return []
+    except Exception as e:
+        backoff = watchmode_negatives.record_failure(key)
+        print(f"{e}. Retrying in {backoff}s at the earliest")
+        return []
+
+
+# How much of the watchmode monthly quota is left and how the app is degrading because of it
+@search_bp.route("/watchmode/budget", methods=["GET"])
+def watchmode_budget():
+    return jsonify(watchmode_quota.get_budget())
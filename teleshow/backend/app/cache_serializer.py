@@ -0,0 +1,240 @@
+# Serializer for the tiered cache
+# Pickled TMDB responses are big (details has every cast member and every image) and sqlite reads get slow.
+# Values are packed with msgpack and compressed with zstd using a dictionary trained on our own cached payloads.
+# TMDB responses repeat the same keys and urls over and over so the dictionary does most of the work.
+# Both libraries are optional. Without msgpack values are pickled, without zstandard zlib is used.
+# Every value starts with two tag bytes (format, compression) so old entries can still be read:
+#   format       p = pickle, m = msgpack
+#   compression  n = none, z = zlib, s = zstd, d = zstd with a trained dictionary
+# Entries the tiered cache wrote before this serializer are plain pickles (first byte 0x80) and are read as pickle.
+import glob
+import os
+import pickle
+import threading
+import zlib
+
+from flask import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Values smaller than this aren't worth compressing
+COMPRESS_MIN_SIZE = 256
+ZSTD_LEVEL = 3
+# Samples collected before a dictionary is trained, and its size
+DICT_SAMPLES = 1000
+DICT_SIZE = 112 * 1024
+
+# msgpack extension types
+EXT_PICKLE = 0
+EXT_RESPONSE = 1
+
+
+# Flask Responses (cached views) are packed as status, headers and body. Anything else msgpack
+# doesn't know (sets, exceptions) is pickled inside the msgpack data
+def encode_ext(obj):
+    if isinstance(obj, Response):
+        return msgpack.ExtType(
+            EXT_RESPONSE,
+            msgpack.packb(
+                [obj.status_code, list(obj.headers.items()), obj.get_data()],
+                use_bin_type=True,
+            ),
+        )
+    return msgpack.ExtType(EXT_PICKLE, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def decode_ext(code, data):
+    if code == EXT_RESPONSE:
+        status, headers, body = msgpack.unpackb(data, raw=False)
+        return Response(body, status=status, headers=headers)
+    if code == EXT_PICKLE:
+        return pickle.loads(data)
+    return msgpack.ExtType(code, data)
+
+
+class CacheSerializer:
+    def __init__(self, dict_dir=None, use_msgpack=True, use_zstd=True):
+        self.use_msgpack = use_msgpack and msgpack is not None
+        self.use_zstd = use_zstd and zstandard is not None
+        # Trained dictionaries are saved here as cache_dict-<id>.zstd. All of them are kept so entries
+        # compressed with an older dictionary can still be read after a new one is trained
+        # Every process using the same cache reads them from here, so one process's dictionary
+        # is picked up by the others when they meet an entry compressed with it
+        self.dict_dir = dict_dir
+        self._lock = threading.Lock()
+        self._samples = []
+        self._training = False
+        self._dicts = {}  # dictionary id -> dictionary bytes
+        self._current_dict_id = None
+        # zstd compressors can't be used by two threads at once so each thread makes its own
+        self._local = threading.local()
+        if self.use_zstd:
+            self._load_dictionaries()
+
+    def _load_dictionaries(self):
+        if not self.dict_dir:
+            return
+        paths = glob.glob(os.path.join(self.dict_dir, "cache_dict-*.zstd"))
+        # Newest last so it ends up as the one used for compressing
+        for path in sorted(paths, key=os.path.getmtime):
+            dict_id, dict_bytes = self._read_dictionary(path)
+            if dict_id is None:
+                continue
+            self._dicts[dict_id] = dict_bytes
+            self._current_dict_id = dict_id
+
+    # Returns (dictionary id, bytes), or (None, None) if the file can't be read
+    @staticmethod
+    def _read_dictionary(path):
+        try:
+            with open(path, "rb") as f:
+                dict_bytes = f.read()
+            return zstandard.ZstdCompressionDict(dict_bytes).dict_id(), dict_bytes
+        except (OSError, zstandard.ZstdError) as e:
+            print(f"Error loading cache dictionary {path}: {e}")
+            return None, None
+
+    # Bytes of a dictionary. One this process hasn't seen (trained by another process) is read from dict_dir
+    def _dictionary(self, dict_id):
+        dict_bytes = self._dicts.get(dict_id)
+        if dict_bytes is not None:
+            return dict_bytes
+        if self.dict_dir:
+            with self._lock:
+                if dict_id not in self._dicts:
+                    path = os.path.join(self.dict_dir, f"cache_dict-{dict_id}.zstd")
+                    if os.path.exists(path):
+                        loaded_id, dict_bytes = self._read_dictionary(path)
+                        if loaded_id == dict_id:
+                            self._dicts[dict_id] = dict_bytes
+            dict_bytes = self._dicts.get(dict_id)
+        if dict_bytes is None:
+            raise ValueError(f"Missing cache dictionary {dict_id}")
+        return dict_bytes
+
+    def _compressor(self, dict_id):
+        cached = getattr(self._local, "compressor", None)
+        if cached is None or cached[0] != dict_id:
+            if dict_id is None:
+                compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            else:
+                compressor = zstandard.ZstdCompressor(
+                    level=ZSTD_LEVEL,
+                    dict_data=zstandard.ZstdCompressionDict(self._dicts[dict_id]),
+                )
+            cached = (dict_id, compressor)
+            self._local.compressor = cached
+        return cached[1]
+
+    # dict_id 0 is the plain decompressor
+    def _decompressor(self, dict_id):
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id == 0:
+                decompressor = zstandard.ZstdDecompressor()
+            else:
+                decompressor = zstandard.ZstdDecompressor(
+                    dict_data=zstandard.ZstdCompressionDict(self._dictionary(dict_id))
+                )
+            decompressors[dict_id] = decompressor
+        return decompressor
+
+    # Collects payloads until there are enough to train a dictionary, then trains one in the background
+    def _add_sample(self, payload):
+        if self._current_dict_id is not None or not self.dict_dir:
+            return
+        with self._lock:
+            if self._training:
+                return
+            self._samples.append(payload)
+            if len(self._samples) < DICT_SAMPLES:
+                return
+            samples = self._samples
+            self._samples = []
+            # Another process sharing the cache may have trained one already. It's used instead of training a second
+            self._load_dictionaries()
+            if self._current_dict_id is not None:
+                return
+            self._training = True
+
+        def train():
+            try:
+                self.train_dictionary(samples)
+            except Exception as e:
+                print(f"Error training cache dictionary: {e}")
+            finally:
+                self._training = False
+
+        trainer = threading.Thread(target=train, name="cache-dict-trainer")
+        trainer.daemon = True
+        trainer.start()
+
+    def train_dictionary(self, samples):
+        dictionary = zstandard.train_dictionary(DICT_SIZE, samples)
+        dict_id = dictionary.dict_id()
+        dict_bytes = dictionary.as_bytes()
+        if self.dict_dir:
+            path = os.path.join(self.dict_dir, f"cache_dict-{dict_id}.zstd")
+            # Written under another name and renamed so other processes never read half a file
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(dict_bytes)
+            os.replace(temp_path, path)
+        with self._lock:
+            self._dicts[dict_id] = dict_bytes
+            self._current_dict_id = dict_id
+        print(f"Trained cache dictionary {dict_id} on {len(samples)} values")
+        return dict_id
+
+    def dumps(self, value):
+        if self.use_msgpack:
+            fmt = b"m"
+            payload = msgpack.packb(value, default=encode_ext, use_bin_type=True)
+        else:
+            fmt = b"p"
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        if len(payload) < COMPRESS_MIN_SIZE:
+            return fmt + b"n" + payload
+        if not self.use_zstd:
+            return fmt + b"z" + zlib.compress(payload, 6)
+        self._add_sample(payload)
+        dict_id = self._current_dict_id
+        compression = b"s" if dict_id is None else b"d"
+        return fmt + compression + self._compressor(dict_id).compress(payload)
+
+    def loads(self, data):
+        # Written before tag bytes existed
+        if self.is_legacy(data):
+            return pickle.loads(data)
+
+        fmt, compression, payload = data[:1], data[1:2], data[2:]
+        if compression == b"z":
+            payload = zlib.decompress(payload)
+        elif compression == b"s":
+            payload = self._decompressor(0).decompress(payload)
+        elif compression == b"d":
+            dict_id = zstandard.get_frame_parameters(payload).dict_id
+            payload = self._decompressor(dict_id).decompress(payload)
+
+        if fmt == b"m":
+            return msgpack.unpackb(
+                payload, ext_hook=decode_ext, raw=False, strict_map_key=False
+            )
+        return pickle.loads(payload)
+
+    # True for entries that should be rewritten in the current format
+    @staticmethod
+    def is_legacy(data):
+        return data[:1] == b"\x80"
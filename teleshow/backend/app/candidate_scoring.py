@@ -0,0 +1,95 @@
+# Scores recommendation candidates as arrays instead of one at a time
+# Each candidate's genre and keyword ids are laid out flat, one after another, with a second array saying
+# which candidate each id belongs to (the same thing a sparse row matrix stores). Overlap with the source
+# title is then one np.isin and one np.bincount for the whole pool, and the top 24 come from np.argpartition
+# instead of sorting everything. The weights and bonuses are the same ones the scoring loop used.
+from itertools import chain
+
+import numpy as np
+
+TOP_K = 24
+
+
+# Request ids come in as strings ("28,12"). TMDB's are ints, so everything is made an int to be comparable
+def to_int_ids(values):
+    ids = []
+    for value in values or []:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+# Flattens a list of id lists. Returns (ids, owner row of each id, number of ids per row)
+# The ids in a row have to be distinct, like the sets the loop made. The feature store keeps them that way
+def flatten_ids(id_lists):
+    count = len(id_lists)
+    lengths = np.fromiter(map(len, id_lists), dtype=np.int64, count=count)
+    flat = np.fromiter(
+        chain.from_iterable(id_lists), dtype=np.int64, count=int(lengths.sum())
+    )
+    owners = np.repeat(np.arange(count, dtype=np.int64), lengths)
+    return flat, owners, lengths
+
+
+# Shared ids and Jaccard similarity between the source ids and every row
+def jaccard(source_ids, flat, owners, lengths):
+    source = np.unique(np.asarray(source_ids, dtype=np.int64))
+    common = np.bincount(owners[np.isin(flat, source)], minlength=len(lengths))
+    union = lengths + len(source) - common
+    similarity = np.divide(
+        common, union, out=np.zeros(len(lengths), dtype=np.float64), where=union > 0
+    )
+    return common, similarity
+
+
+# Returns the indexes of the best candidates, best first, and their scores
+# features is one dict per candidate with genre_ids, keyword_ids, popularity
+def score_candidates(
+    source_genre_ids, source_keyword_ids, features, text_sims, k=TOP_K
+):
+    count = len(features)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    source_genre_ids = to_int_ids(source_genre_ids)
+    source_keyword_ids = to_int_ids(source_keyword_ids)
+
+    # Genre similarity check
+    # Jaccard Similarity = |Intersection| / |Union|
+    # Titles that share genres get at least 0.2 + 0.1 per shared genre (up to 0.6)
+    flat, owners, lengths = flatten_ids([f["genre_ids"] for f in features])
+    if source_genre_ids:
+        common, genre_sim = jaccard(source_genre_ids, flat, owners, lengths)
+        bonus = np.minimum(0.2 + common * 0.1, 0.6)
+        genre_sim = np.where(common > 0, np.maximum(genre_sim, bonus), genre_sim)
+        genre_sim[lengths == 0] = 0.1
+    else:
+        genre_sim = np.full(count, 0.1)
+
+    # Keyword similarity check. Any shared keyword is worth at least 0.3
+    flat, owners, lengths = flatten_ids([f["keyword_ids"] for f in features])
+    if source_keyword_ids:
+        common, keyword_sim = jaccard(source_keyword_ids, flat, owners, lengths)
+        keyword_sim = np.where(common > 0, np.maximum(keyword_sim, 0.3), keyword_sim)
+    else:
+        keyword_sim = np.zeros(count)
+
+    text_sim = np.asarray(text_sims, dtype=np.float64)
+    popularity = np.array([f["popularity"] or 0 for f in features], dtype=np.float64)
+
+    total_score = (
+        (np.minimum(genre_sim, 1.0) * 0.35)  # Genre importance: 35%
+        + (np.minimum(text_sim, 1.0) * 0.30)  # Text similarity importance: 30%
+        + (np.minimum(keyword_sim, 1.0) * 0.25)  # Keyword importance: 25%
+        + (np.minimum(popularity / 100, 1.0) * 0.10)  # Popularity importance: 10%
+    )
+    total_score = np.minimum(total_score * 10, 10)
+
+    candidates = np.arange(count)
+    if count > k:
+        candidates = np.argpartition(-total_score, k - 1)[:k]
+    # Best first. Ties keep the pool's order like the stable sort did
+    order = np.lexsort((candidates, -total_score[candidates]))
+    candidates = candidates[order]
+    return candidates, total_score[candidates]
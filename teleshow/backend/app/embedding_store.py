@@ -0,0 +1,183 @@
+# Saved sentence embeddings for every title and overview we've compared
+# calculate_similarity used to encode the source and every candidate again on each call, and the same popular
+# titles came up in almost every recommendation pool. Now each text is encoded once per model version.
+#   embeddings-<version>.f16 - one L2 normalized float16 row per text, read through a memory map
+#   embeddings.sqlite3       - (media_type, media_id, field, model_version) -> row, plus a hash of the text
+# Rows are normalized so cosine similarity is a dot product. A text that changed (TMDB overview edits)
+# is encoded again and the key points at a new row. The old row is just left behind.
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from app.extensions import get_data_dir, MODEL_NAME
+
+DTYPE = np.float16
+
+
+def text_hash(text):
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingStore:
+    def __init__(self, data_dir, model_version):
+        self.model_version = model_version
+        version_id = hashlib.md5(model_version.encode("utf-8")).hexdigest()[:8]
+        self.matrix_path = os.path.join(data_dir, f"embeddings-{version_id}.f16")
+        self._lock = threading.Lock()
+        # (media_type, media_id, field) -> (row, text hash)
+        self._index = {}
+        self._dim = None
+        self._rows = 0
+        self._matrix = None  # Memory map of the first self._rows rows
+        self.stats = {"hits": 0, "encoded": 0}
+
+        # Every worker process appends to the same matrix file. isolation_level=None lets BEGIN IMMEDIATE
+        # lock the database across processes, and the matrix file is only changed while that lock is held
+        self._conn = sqlite3.connect(
+            os.path.join(data_dir, "embeddings.sqlite3"),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (media_type TEXT, media_id TEXT, field TEXT, "
+            "model_version TEXT, row INTEGER, text_hash TEXT, "
+            "PRIMARY KEY (media_type, media_id, field, model_version))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_dims (model_version TEXT PRIMARY KEY, dim INTEGER)"
+        )
+        self._load()
+
+    # Used as: with self._file_lock(): ... Holds the sqlite write lock so no other process
+    # changes the matrix file or the index in the meantime. Rolled back if anything fails
+    @contextlib.contextmanager
+    def _file_lock(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    # Number of whole rows in the matrix file. Has to be called with the file lock held
+    # A crash in the middle of a write leaves part of a row at the end. It's cut off so the
+    # next append starts on a row boundary instead of shifting every row after it
+    def _whole_rows(self):
+        if not os.path.exists(self.matrix_path):
+            return 0
+        row_bytes = self._dim * np.dtype(DTYPE).itemsize
+        size = os.path.getsize(self.matrix_path)
+        rows = size // row_bytes
+        if size != rows * row_bytes:
+            print(f"Removing a partly written row from {self.matrix_path}")
+            os.truncate(self.matrix_path, rows * row_bytes)
+        return rows
+
+    def _load(self):
+        with self._lock, self._file_lock():
+            row = self._conn.execute(
+                "SELECT dim FROM embedding_dims WHERE model_version = ?",
+                (self.model_version,),
+            ).fetchone()
+            if row is None or not os.path.exists(self.matrix_path):
+                return
+            self._dim = row[0]
+            # Rows written to the file but never indexed (the app stopped in between) are just skipped
+            self._rows = self._whole_rows()
+            for media_type, media_id, field, index_row, hash_ in self._conn.execute(
+                "SELECT media_type, media_id, field, row, text_hash FROM embeddings WHERE model_version = ?",
+                (self.model_version,),
+            ):
+                if index_row < self._rows:
+                    self._index[(media_type, media_id, field)] = (index_row, hash_)
+            self._remap()
+
+    # Has to be called with the lock held
+    def _remap(self):
+        if self._rows == 0:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(
+            self.matrix_path, dtype=DTYPE, mode="r", shape=(self._rows, self._dim)
+        )
+
+    # Appends normalized vectors to the matrix and points the keys at them
+    # The first row comes from the file's size, not self._rows, since other processes append to it too
+    def _append(self, keys, hashes, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.maximum(norms, 1e-12)).astype(DTYPE)
+        with self._lock:
+            start = None
+            try:
+                with self._file_lock():
+                    if self._dim is None:
+                        self._dim = vectors.shape[1]
+                        self._conn.execute(
+                            "INSERT OR IGNORE INTO embedding_dims VALUES (?, ?)",
+                            (self.model_version, self._dim),
+                        )
+                    start = self._whole_rows()
+                    with open(self.matrix_path, "ab") as f:
+                        f.write(vectors.tobytes())
+                    rows = range(start, start + len(vectors))
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)",
+                        [
+                            (key[0], key[1], key[2], self.model_version, row, hash_)
+                            for key, hash_, row in zip(keys, hashes, rows)
+                        ],
+                    )
+            except sqlite3.Error as e:
+                if start is None:
+                    raise
+                # The rows are in the file. They just won't be found again after a restart
+                print(f"Error saving embedding index: {e}")
+            self._rows = start + len(vectors)
+            for key, hash_, row in zip(keys, hashes, rows):
+                self._index[key] = (row, hash_)
+            self._remap()
+
+    # Returns a (len(keys), dim) float32 matrix of normalized embeddings
+    # keys are (media_type, media_id, field) and texts the text for each. encode(texts) is only called
+    # for the texts that aren't stored yet (or changed), all in one batch
+    def get_vectors(self, keys, texts, encode):
+        keys = [(str(t), str(i), f) for t, i, f in keys]
+        hashes = [text_hash(text) for text in texts]
+        with self._lock:
+            missing = {}
+            for position, (key, hash_) in enumerate(zip(keys, hashes)):
+                entry = self._index.get(key)
+                if entry is None or entry[1] != hash_:
+                    missing.setdefault(key, position)
+            self.stats["hits"] += len(keys) - len(missing)
+            self.stats["encoded"] += len(missing)
+
+        if missing:
+            positions = list(missing.values())
+            vectors = encode([texts[p] for p in positions])
+            self._append(list(missing), [hashes[p] for p in positions], vectors)
+
+        with self._lock:
+            rows = [self._index[key][0] for key in keys]
+            # One gather out of the memory map
+            return np.asarray(self._matrix[rows], dtype=np.float32)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "rows": self._rows,
+                "keys": len(self._index),
+                "dim": self._dim,
+                "bytes": self._rows * (self._dim or 0) * np.dtype(DTYPE).itemsize,
+            }
+
+
+embedding_store = EmbeddingStore(get_data_dir(), MODEL_NAME)
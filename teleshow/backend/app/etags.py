@@ -0,0 +1,65 @@
+# Strong ETags and If-None-Match handling for the read endpoints
+# The frontend asks for the same details, trending and watchlists over and over. With an ETag the browser sends
+# If-None-Match on the next request and gets an empty 304 back when nothing changed.
+#   Cached views (view_cache.swr_cached) - the tag is a hash of the cached body, made once when it's stored
+#   Listener endpoints (watchlists, followed) - the tag comes from the listener cache's version counter,
+#                                               so a 304 is sent without building the body at all
+# Responses get Cache-Control: no-cache so the browser keeps them but asks every time.
+import functools
+import hashlib
+import uuid
+
+from flask import request, Response, make_response
+
+# Listener versions start at 0 again after a restart so the tags include an id for this run
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+def body_etag(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def listener_etag(listener_key, version):
+    return hashlib.md5(f"{RUN_ID}-{listener_key}-{version}".encode("utf-8")).hexdigest()
+
+
+# Returns the tag from If-None-Match that matches, or None
+# flask_compress turns a strong tag into "tag:gzip" when it compresses the body so those count as a match too
+def matching_etag(etag):
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return etag
+    for tag in if_none_match.as_set():
+        if tag == etag or tag.startswith(etag + ":"):
+            return tag
+    return None
+
+
+def not_modified(etag, cache_control="no-cache"):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def set_etag(response, etag, cache_control="no-cache"):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+# For cached endpoints that still go through cache.cached. The body comes from the cache so hashing it is cheap
+def with_etag(f):
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        response = make_response(f(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        etag = body_etag(response.get_data())
+        matched = matching_etag(etag)
+        if matched:
+            return not_modified(matched)
+        return set_etag(response, etag)
+
+    return decorated_function
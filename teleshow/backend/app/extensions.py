@@ -4,6 +4,8 @@ from flask_limiter import Limiter  # Rate Limiting
 import tmdbsimple as tmdb
 from flask_compress import Compress
 from flask_limiter.util import get_remote_address
+from app.upstream import upstream_session
+from app.json_provider import FastJSONProvider
 import firebase_admin  # Firebase imports that allow connection to firestore for user data
 from firebase_admin import credentials
 from firebase_admin import firestore
@@ -25,6 +27,8 @@ limiter = Limiter(
 compress = Compress()
 
 # Global Variables
+# The sentence transformer model. Saved embeddings are tied to it (see embedding_store.py)
+MODEL_NAME = "sentence-transformers/static-similarity-mrl-multilingual-v1"
 db = None
 model = None
 model_loading = False
@@ -63,6 +67,20 @@ def get_cache_dir():
     return cache_dir
 
 
+# Directory for the local stores (indexes, ledgers) that have to survive restarts
+# The executable's MEIPASS folder is deleted when it closes so the data is kept next to the executable instead
+def get_data_dir():
+    if getattr(sys, "frozen", False):
+        data_dir = os.path.join(os.path.dirname(sys.executable), "teleshow_data")
+    else:
+        data_dir = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "teleshow_data"
+        )
+
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
 load_dotenv(dotenv_path=dotenv_path)
 
 
@@ -79,12 +97,11 @@ def load_model_task():
         print("Beginning to load sentence transformer model...")
         start_time = time.time()
         # Generates a numerical representation (embedding) for the entire sentence or paragraph, enabling it to measure semantic similarity efficiently.
-        from sentence_transformers import SentenceTransformer
+        # The model is a static one so it runs on NumPy without torch (see static_encoder.py)
+        from app.static_encoder import StaticEncoder
 
         # Sets the pre-trained learning model for Sentence Transformer
-        model = SentenceTransformer(
-            "sentence-transformers/static-similarity-mrl-multilingual-v1"
-        )
+        model = StaticEncoder.load(MODEL_NAME)
         elapsed = time.time() - start_time
         print(f"Sentence transformer model loaded successfully in {elapsed:2f} seconds")
     except Exception as e:
@@ -132,13 +149,18 @@ def get_model():
 def init_app(app):
     # Initializes Cache with a default ttl of 30 minutes
     # Since we are using an executable to deploy and thus are only really expecting one user per executable. Therefore im saving the cache in the file system instead of memory.
+    # The tiered cache keeps recent entries in memory in front of a sqlite file in the cache directory
+    # CACHE_THRESHOLD is the most entries kept in sqlite. PY_CACHE_MEMORY_MB is the size of the in memory part
     cache.init_app(
         app,
         config={
-            "CACHE_TYPE": "FileSystemCache",
+            "CACHE_TYPE": "app.tiered_cache.TieredCache",
             "CACHE_DIR": get_cache_dir(),
             "CACHE_THRESHOLD": 5000,
             "CACHE_DEFAULT_TIMEOUT": 86400,
+            "CACHE_OPTIONS": {
+                "l1_max_bytes": int(os.getenv("PY_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+            },
         },
     )
 
@@ -147,8 +169,13 @@ def init_app(app):
 
     compress.init_app(app)
 
+    # jsonify and get_json go through orjson when it's installed
+    app.json = FastJSONProvider(app)
+
     # Sets the API key using the tmdbsimple library
     tmdb.API_KEY = os.getenv("PY_TMDB_API_KEY")
+    # Sends every tmdbsimple call through the shared pooled session
+    tmdb.REQUESTS_SESSION = upstream_session
 
     # Configures compression
     app.config["COMPRESS_MIMETYPES"] = [
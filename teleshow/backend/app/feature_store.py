@@ -0,0 +1,180 @@
+# Features of recommendation candidates
+# Scoring a candidate only needs its genre ids, keyword ids, original language and popularity, but it used to
+# cost a TMDB info call per candidate, one after another, up to 100 per recommendation request.
+# Those four fields are kept here per title in memory and in sqlite so every request reuses them.
+# get_many fetches all the missing titles at the same time before scoring starts, and titles older than
+# MAX_AGE are used as they are while they're refreshed in the background.
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from app.extensions import get_data_dir
+from app.rate_budget import background_priority
+
+# Popularity moves but genres and keywords hardly ever do
+MAX_AGE = 7 * 24 * 60 * 60
+# Seconds get_many waits for missing titles. Whatever isn't back by then is scored without features
+FILL_TIMEOUT = 10
+
+# Every fetch goes through the upstream session so the rate budget still applies
+# Missing titles a request is waiting on are fetched here
+fill_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="feature-fill")
+# Stale titles are refreshed on their own small pool so a burst of them can't hold up a request's fills
+refresh_executor = ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="feature-refresh"
+)
+
+
+def media_key(media_type, media_id):
+    return f"{media_type}:{media_id}"
+
+
+def join_ids(ids):
+    return ",".join(str(i) for i in ids)
+
+
+def split_ids(value):
+    return tuple(int(i) for i in value.split(",")) if value else ()
+
+
+# Drops repeated ids but keeps the order. Scoring counts each id once per title
+def unique_ids(ids):
+    return tuple(dict.fromkeys(ids))
+
+
+class FeatureStore:
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        # media key -> features dictionary
+        self._features = {}
+        # Keys being fetched right now, so two requests don't fetch the same title
+        self._pending = {}
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "fetched": 0,
+            "failed": 0,
+        }
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS features (media_key TEXT PRIMARY KEY, genre_ids TEXT, "
+            "keyword_ids TEXT, original_language TEXT, popularity REAL, fetched_at REAL)"
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        with self._lock:
+            for (
+                key,
+                genres,
+                keywords,
+                language,
+                popularity,
+                fetched_at,
+            ) in self._conn.execute("SELECT * FROM features"):
+                self._features[key] = {
+                    "genre_ids": unique_ids(split_ids(genres)),
+                    "keyword_ids": unique_ids(split_ids(keywords)),
+                    "original_language": language,
+                    "popularity": popularity,
+                    "fetched_at": fetched_at,
+                }
+
+    def put(self, media_type, media_id, genre_ids, keyword_ids, language, popularity):
+        key = media_key(media_type, media_id)
+        features = {
+            "genre_ids": unique_ids(genre_ids),
+            "keyword_ids": unique_ids(keyword_ids),
+            "original_language": language,
+            "popularity": popularity or 0,
+            "fetched_at": time.time(),
+        }
+        with self._lock:
+            self._features[key] = features
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        join_ids(features["genre_ids"]),
+                        join_ids(features["keyword_ids"]),
+                        language,
+                        features["popularity"],
+                        features["fetched_at"],
+                    ),
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"Error saving features for {key}: {e}")
+        return features
+
+    # fetch(media_id, media_type) returns (genre_ids, keyword_ids, original_language, popularity)
+    def _fetch(self, media_type, media_id, fetch):
+        try:
+            result = self.put(media_type, media_id, *fetch(media_id, media_type))
+            with self._lock:
+                self.stats["fetched"] += 1
+            return result
+        except Exception as e:
+            print(f"Error fetching features for {media_type} {media_id}: {e}")
+            with self._lock:
+                self.stats["failed"] += 1
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(media_key(media_type, media_id), None)
+
+    def _background_fetch(self, media_type, media_id, fetch):
+        with background_priority():
+            return self._fetch(media_type, media_id, fetch)
+
+    # Returns {(media_type, media_id): features or None} for every (media_type, media_id) in items
+    # Missing titles are fetched at the same time and waited on (up to FILL_TIMEOUT), stale ones aren't
+    def get_many(self, items, fetch):
+        results = {}
+        waiting = {}
+        now = time.time()
+        with self._lock:
+            for media_type, media_id in items:
+                key = media_key(media_type, media_id)
+                features = self._features.get(key)
+                pending = self._pending.get(key)
+                if features is not None:
+                    results[(media_type, media_id)] = features
+                    if now - features["fetched_at"] <= MAX_AGE:
+                        self.stats["hits"] += 1
+                        continue
+                    self.stats["stale_hits"] += 1
+                    if pending is None:
+                        self._pending[key] = refresh_executor.submit(
+                            self._background_fetch, media_type, media_id, fetch
+                        )
+                    continue
+                self.stats["misses"] += 1
+                if pending is None:
+                    pending = self._pending[key] = fill_executor.submit(
+                        self._fetch, media_type, media_id, fetch
+                    )
+                waiting[(media_type, media_id)] = pending
+
+        if waiting:
+            wait(list(waiting.values()), timeout=FILL_TIMEOUT)
+        for item, future in waiting.items():
+            results[item] = future.result() if future.done() else None
+        return results
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "titles": len(self._features),
+                "pending": len(self._pending),
+            }
+
+
+feature_store = FeatureStore(os.path.join(get_data_dir(), "features.sqlite3"))
@@ -27,6 +27,8 @@ EVICTION_MAP = {
 }
 
 active_listeners = {}
+# Bumped every time a listener updates its cache. The read endpoints build their ETags from it
+cache_versions = {}
 cache_lock = threading.RLock()
 listener_lock = threading.RLock()
 
@@ -38,6 +40,19 @@ _initializing_lock = threading.Lock()
 users_ref = get_db().collection("users-test")
 
 
+def _bump_version(listener_key):
+    # Called with cache_lock held
+    cache_versions[listener_key] = cache_versions.get(listener_key, 0) + 1
+
+
+def get_cache_version(listener_key):
+    """Returns the version of a listener cache, or None if its listener isn't running yet"""
+    if listener_key not in active_listeners:
+        return None
+    with cache_lock:
+        return cache_versions.get(listener_key)
+
+
 # Utility to register a listener
 def _attach_listener(key: str, create_fn):
     if key in active_listeners:
@@ -63,6 +78,7 @@ def get_cached_user_data(user_id):
                 for doc in doc_snapshot:
                     user_cache[user_id] = doc.to_dict()
                     logger.info(f"User document cached for {user_id}")
+                _bump_version(listener_key)
         except Exception as e:
             logger.error(f"Error in user snapshot listener: {str(e)}")
         finally:
@@ -94,6 +110,7 @@ def get_cached_user_ratings(user_id):
                 }
                 ratings_cache[user_id] = ratings
                 logger.info(f"Ratings cached for {user_id}")
+                _bump_version(listener_key)
         except Exception as e:
             logger.error(f"Error in ratings snapshot listener: {str(e)}")
         finally:
@@ -145,6 +162,7 @@ def get_cached_user_comments(user_id):
                 else:
                     logger.debug("Empty snapshot after initial load; ignoring.")
                 logger.info(f"Comments cached for {user_id}")
+                _bump_version(listener_key)
         except Exception as e:
             logger.error(f"Error in comments snapshot listener: {str(e)}")
         finally:
@@ -213,6 +231,7 @@ def get_cached_user_watchlists(user_id):
                     logger.debug("Empty snapshot after initial load; ignoring.")
 
                 logger.info(f"Watchlists cached for {user_id}")
+                _bump_version(listener_key)
 
         except Exception as e:
             logger.error(f"Error in watchlists snapshot listener: {str(e)}")
@@ -283,6 +302,8 @@ def setup_watchlist_media_listener(user_id, watchlist_id):
                                 ]
 
                     logger.info(f"Media cached for watchlist {watchlist_id}")
+                    # The watchlists endpoints read the media through the user's watchlist cache
+                    _bump_version(f"watchlists_{user_id}")
             except Exception as e:
                 logger.error(f"Error in watchlist media snapshot listener: {str(e)}")
 
@@ -340,6 +361,7 @@ def get_cached_followed_media(user_id):
                     logger.debug("Empty snapshot after initial load; ignoring.")
 
                 logger.info(f"Followed media cached for {user_id}")
+                _bump_version(listener_key)
         except Exception as e:
             logger.error(f"Error in followed media snapshot listener: {str(e)}")
         finally:
@@ -398,6 +420,7 @@ def get_cached_tv_progress(user_id):
                     logger.debug("Empty snapshot after initial load; ignoring.")
 
                 logger.info(f"TV progress cached for {user_id}")
+                _bump_version(listener_key)
         except Exception as e:
             logger.error(f"Error in TV progress snapshot listener: {str(e)}")
         finally:
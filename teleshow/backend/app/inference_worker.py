@@ -0,0 +1,173 @@
+# Embedding inference worker
+# Recommendation requests used to encode their own small batches on the request thread, so a few at once
+# each ran the model separately. Now every encode goes through a queue to worker threads that merge
+# whatever arrives within a few milliseconds into one batch and hand each caller back its own rows.
+# encode() blocks like model.encode did.
+# Settings (environment):
+#   PY_INFERENCE_WORKERS  - worker threads taking batches off the queue (default 1)
+#   PY_INFERENCE_THREADS  - threads the tokenizer and NumPy may use inside one batch (default 2)
+#   PY_INFERENCE_BATCH    - most texts merged into one batch (default 512)
+#   PY_INFERENCE_WAIT_MS  - how long a batch waits for more requests once it has one (default 5)
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from app.extensions import get_model
+
+INFERENCE_THREADS = int(os.getenv("PY_INFERENCE_THREADS", "2"))
+# The tokenizers library reads this when it starts its thread pool, which happens on the first encode
+os.environ.setdefault("RAYON_NUM_THREADS", str(INFERENCE_THREADS))
+
+try:
+    # Limits BLAS threads if it's installed. Without it NumPy uses its own default
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Batch sizes counted in the stats
+BATCH_BUCKETS = [1, 16, 64, 256, 1024]
+
+
+class InferenceWorker:
+    def __init__(self, get_model, workers=1, max_batch=512, max_wait=0.005):
+        # Called on the worker thread so the first batch waits for the model instead of a request thread
+        self.get_model = get_model
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "batched_requests": 0,
+            "texts": 0,
+            "batches": 0,
+            "errors": 0,
+            "max_queue_depth": 0,
+            "max_batch_texts": 0,
+            "encode_seconds": 0.0,
+            "queue_wait_seconds": 0.0,
+        }
+        self.batch_sizes = {bucket: 0 for bucket in BATCH_BUCKETS + ["more"]}
+
+    def _start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name=f"inference-worker-{i}"
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    # Blocking API. Returns a (len(texts), dim) float32 array
+    def encode(self, texts, timeout=60):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self._start()
+        future = Future()
+        self._queue.put((texts, future, time.monotonic()))
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["max_queue_depth"] = max(
+                self.stats["max_queue_depth"], self._queue.qsize()
+            )
+        return future.result(timeout=timeout)
+
+    # Takes one request, then keeps adding whatever shows up until the batch is full or max_wait runs out
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._next_batch()
+            started = time.monotonic()
+            texts = [text for request in batch for text in request[0]]
+            try:
+                model = self.get_model()
+                if model is None:
+                    raise RuntimeError("Sentence transformer model isn't loaded")
+                if threadpool_limits is not None:
+                    with threadpool_limits(limits=INFERENCE_THREADS):
+                        vectors = model.encode(
+                            texts, batch_size=size, convert_to_numpy=True
+                        )
+                else:
+                    vectors = model.encode(
+                        texts, batch_size=size, convert_to_numpy=True
+                    )
+            except Exception as e:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            # Each caller gets its own slice back
+            start = 0
+            for request_texts, future, _ in batch:
+                future.set_result(vectors[start : start + len(request_texts)])
+                start += len(request_texts)
+            self._record_batch(batch, size, started)
+
+    def _record_batch(self, batch, size, started):
+        with self._stats_lock:
+            self.stats["batches"] += 1
+            self.stats["batched_requests"] += len(batch)
+            self.stats["texts"] += size
+            self.stats["max_batch_texts"] = max(self.stats["max_batch_texts"], size)
+            self.stats["encode_seconds"] += time.monotonic() - started
+            self.stats["queue_wait_seconds"] += sum(
+                started - queued_at for _, _, queued_at in batch
+            )
+            bucket = next((b for b in BATCH_BUCKETS if size <= b), "more")
+            self.batch_sizes[bucket] += 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+            batches = stats["batches"]
+            return {
+                **stats,
+                "queue_depth": self._queue.qsize(),
+                "workers": self.workers,
+                "threads_per_batch": INFERENCE_THREADS,
+                "avg_batch_texts": round(stats["texts"] / batches, 1) if batches else 0,
+                "avg_batch_requests": (
+                    round(stats["batched_requests"] / batches, 2) if batches else 0
+                ),
+                "batch_sizes": {
+                    f"<={bucket}" if bucket != "more" else "more": count
+                    for bucket, count in self.batch_sizes.items()
+                },
+            }
+
+
+inference_worker = InferenceWorker(
+    get_model,
+    workers=int(os.getenv("PY_INFERENCE_WORKERS", "1")),
+    max_batch=int(os.getenv("PY_INFERENCE_BATCH", "512")),
+    max_wait=int(os.getenv("PY_INFERENCE_WAIT_MS", "5")) / 1000,
+)
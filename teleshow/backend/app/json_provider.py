@@ -0,0 +1,99 @@
+# JSON provider for every jsonify and request.get_json in the app
+# The standard library encoder is slow on the big lists (search results, recommendations, every episode of a show)
+# and on the Firestore dicts from the listener caches. orjson does the same work several times faster.
+# orjson is optional. Without it this is Flask's normal provider.
+# Firestore timestamps come back as DatetimeWithNanoseconds (a datetime subclass). They're sent in the same
+# HTTP date format Flask always used so the frontend sees the same strings as before.
+import datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Datetimes go through default() so they keep Flask's format instead of orjson's ISO one
+    # Numpy values show up in the recommendation scores
+    ORJSON_OPTIONS = (
+        orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_SERIALIZE_NUMPY
+    )
+
+
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = (
+    "Jan",
+    "Feb",
+    "Mar",
+    "Apr",
+    "May",
+    "Jun",
+    "Jul",
+    "Aug",
+    "Sep",
+    "Oct",
+    "Nov",
+    "Dec",
+)
+
+
+# Same string as werkzeug's http_date, which goes through the email module and ends up slower than the
+# encoding itself on the watchlist payloads (every item has a timestamp)
+def http_date(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc)
+        time_part = f"{value.hour:02d}:{value.minute:02d}:{value.second:02d}"
+    else:
+        time_part = "00:00:00"
+    return (
+        f"{WEEKDAYS[value.weekday()]}, {value.day:02d} {MONTHS[value.month - 1]} "
+        f"{value.year:04d} {time_part} GMT"
+    )
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Keys are left in the order TMDB and Firestore send them. Sorting every dict costs more than it's worth
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        # Covers DatetimeWithNanoseconds too since it's a datetime
+        if isinstance(o, datetime.date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_options(self, indent=False):
+        options = ORJSON_OPTIONS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        # Anything besides indent and separators (cls, a different default...) only the standard library understands
+        if orjson is None or set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs)
+        options = self._orjson_options(bool(kwargs.get("indent")))
+        return orjson.dumps(obj, default=self.default, option=options).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    # Same as Flask's but the bytes from orjson go straight into the response without a round trip through str
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        options = self._orjson_options(indent) | orjson.OPT_APPEND_NEWLINE
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=options),
+            mimetype=self.mimetype,
+        )
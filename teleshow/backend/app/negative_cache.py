@@ -0,0 +1,68 @@
+# Negative caching for upstream lookups
+# A real empty answer ("this title has no US sources") is cached like any other result.
+# This is for the other two cases that used to be mixed up with it:
+#   missing - the upstream doesn't know the title at all. Remembered for a while so we stop asking
+#   failure - the call failed. Each failure in a row doubles how long the key is left alone
+import threading
+
+
+# Raised by lookups when the upstream call failed so the failure isn't memoized as an empty result
+class UpstreamError(Exception):
+    pass
+
+
+# Raised by lookups when the upstream doesn't know the title
+class UpstreamNotFound(Exception):
+    pass
+
+
+class NegativeCache:
+    def __init__(
+        self, cache, prefix, missing_ttl=6 * 3600, base_backoff=30, max_backoff=3600
+    ):
+        self.cache = cache
+        self.prefix = prefix
+        self.missing_ttl = missing_ttl
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._failures = {}  # key -> failures in a row
+        self.stats = {"negative_hits": 0, "missing_recorded": 0, "failures_recorded": 0}
+
+    def _key(self, key):
+        return f"negative-{self.prefix}-{key}"
+
+    # True if the key has a negative entry and the upstream shouldn't be called
+    # has() is used since a miss here is normal and nothing is going to set the key
+    def is_negative(self, key):
+        if not self.cache.has(self._key(key)):
+            return False
+        with self._lock:
+            self.stats["negative_hits"] += 1
+        return True
+
+    def record_missing(self, key):
+        self.cache.set(self._key(key), "missing", timeout=self.missing_ttl)
+        with self._lock:
+            self._failures.pop(key, None)
+            self.stats["missing_recorded"] += 1
+
+    # Backs off exponentially: 30s, 60s, 120s ... up to max_backoff
+    def record_failure(self, key):
+        with self._lock:
+            failures = self._failures.get(key, 0) + 1
+            self._failures[key] = failures
+            self.stats["failures_recorded"] += 1
+        backoff = min(self.base_backoff * 2 ** (failures - 1), self.max_backoff)
+        self.cache.set(self._key(key), "failure", timeout=backoff)
+        return backoff
+
+    def record_success(self, key):
+        with self._lock:
+            if self._failures.pop(key, None) is None:
+                return
+        self.cache.delete(self._key(key))
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "backing_off": len(self._failures)}
@@ -0,0 +1,129 @@
+# Field projection for TMDB and Watchmode payloads
+# TMDB sends far more than the frontend shows (full crew lists, every image size and language, release dates
+# for every country...). Payloads are trimmed to the fields below before they're cached and sent, so less
+# gets pickled, stored and gzipped. Clients can trim further with ?fields=a,b.c (see with_fields_param).
+# A spec is a dict of field -> True (keep as is) or a nested spec. Lists are projected item by item.
+import functools
+
+from flask import request, make_response, current_app
+
+
+def fields(*names, **nested):
+    spec = {name: True for name in names}
+    spec.update(nested)
+    return spec
+
+
+def project(value, spec):
+    if spec is True:
+        return value
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: project(value[key], sub) for key, sub in spec.items() if key in value
+        }
+    return value
+
+
+# Turns "tmdb.id,tmdb.credits.cast.name" into {"tmdb": {"id": True, "credits": {"cast": {"name": True}}}}
+def parse_fields(fields_param):
+    spec = {}
+    for path in fields_param.split(","):
+        parts = [part for part in path.strip().split(".") if part]
+        if not parts:
+            continue
+        node = spec
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            if child is None:
+                child = node[part] = {}
+            node = child
+        else:
+            # A whole field wins over parts of it
+            node[parts[-1]] = True
+    return spec
+
+
+# Fields the search page, slides and watchlist use, plus the ones relevance ranking and the suggest index need
+SEARCH_RESULT_FIELDS = fields(
+    "id",
+    "media_type",
+    "title",
+    "name",
+    "overview",
+    "poster_path",
+    "backdrop_path",
+    "release_date",
+    "first_air_date",
+    "popularity",
+    "vote_average",
+    "vote_count",
+    "genre_ids",
+    "original_language",
+)
+
+# Fields the detail modal and the recommendation request use
+DETAILS_FIELDS = fields(
+    "id",
+    "media_type",
+    "title",
+    "name",
+    "overview",
+    "tagline",
+    "status",
+    "runtime",
+    "release_date",
+    "first_air_date",
+    "number_of_seasons",
+    "number_of_episodes",
+    "in_production",
+    "adult",
+    "original_language",
+    "content_rating",
+    "poster_path",
+    "backdrop_path",
+    "popularity",
+    "vote_average",
+    "vote_count",
+    genres=fields("id", "name"),
+    keywords=fields("id", "name"),
+    production_companies=fields("id", "name", "logo_path"),
+    networks=fields("id", "name", "logo_path"),
+    created_by=fields("id", "name"),
+    spoken_languages=fields("iso_639_1", "english_name"),
+    next_episode_to_air=fields("season_number", "episode_number", "name", "air_date"),
+    credits=fields(cast=fields("id", "name", "character", "profile_path")),
+    images=fields(
+        backdrops=fields("file_path"),
+        posters=fields("file_path"),
+    ),
+    videos=fields(results=fields("id", "key", "name", "site", "type")),
+)
+
+# Fields of a watchmode source the "Where to Watch" table shows
+WATCHMODE_SOURCE_FIELDS = fields(
+    "source_id", "name", "type", "price", "format", "region", "web_url"
+)
+
+
+# Lets a client ask for a slimmer response with ?fields=
+# Goes above the cache decorators so every fields= variant is served from the same cache entry
+def with_fields_param(f):
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        response = make_response(f(*args, **kwargs))
+        fields_param = request.args.get("fields")
+        if not fields_param or response.is_streamed or not response.is_json:
+            return response
+        body = response.get_json(silent=True)
+        if body is None:
+            return response
+        response.set_data(
+            current_app.json.dumps(project(body, parse_fields(fields_param)))
+        )
+        return response
+
+    return decorated_function
@@ -0,0 +1,147 @@
+# Long lived engine for watch provider lookups
+# Before this every search made its own ThreadPoolExecutor and abandoned lookups kept running after the futures timed out.
+# Now there is one bounded set of worker threads shared by every request (search, user recommendations).
+# Each request gets its own batch with a deadline. Workers take one task from each batch in turn (round robin)
+# so a single platform filtered search can't fill the queue and starve everyone else.
+import os
+import threading
+import time
+from collections import deque
+
+
+class LookupBatch:
+    # Holds the tasks and results for a single request
+    def __init__(self, deadline, on_result=None):
+        self.deadline = deadline
+        self.on_result = on_result  # Optional callback for each result as it finishes
+        self.pending = deque()  # (key, fn, args) tuples that haven't started yet
+        self.results = {}
+        self.errors = {}
+        self.remaining = 0
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def expired(self):
+        return self.cancelled or time.monotonic() >= self.deadline
+
+
+class ProviderLookupEngine:
+    def __init__(self, max_workers=6):
+        self.max_workers = max_workers
+        self._batches = deque()  # Batches that still have pending tasks
+        self._condition = threading.Condition()
+        self._workers = []
+        self._started = False
+        # Counters for troubleshooting
+        self.stats = {"completed": 0, "cancelled": 0, "failed": 0}
+
+    # Workers are started on first use so importing the module doesn't spawn threads
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._condition:
+            if self._started:
+                return
+            for i in range(self.max_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop, name=f"provider-lookup-{i}"
+                )
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            self._started = True
+
+    # Takes the next task fairly. Expired batches are dropped here which is where abandoned work is actually cancelled
+    def _next_task(self):
+        while self._batches:
+            batch = self._batches.popleft()
+            if batch.expired():
+                self._drop_pending(batch)
+                continue
+            task = batch.pending.popleft()
+            # Puts the batch at the back of the line if it still has work so other requests get a turn
+            if batch.pending:
+                self._batches.append(batch)
+            return batch, task
+        return None, None
+
+    def _drop_pending(self, batch):
+        dropped = len(batch.pending)
+        batch.pending.clear()
+        batch.remaining -= dropped
+        self.stats["cancelled"] += dropped
+        if batch.remaining <= 0:
+            batch.done.set()
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                batch, task = self._next_task()
+                while batch is None:
+                    self._condition.wait()
+                    batch, task = self._next_task()
+
+            key, fn, args = task
+            try:
+                result = fn(*args)
+                with self._condition:
+                    # Results that show up after the deadline are thrown away
+                    accepted = not batch.cancelled
+                    if accepted:
+                        batch.results[key] = result
+                    self.stats["completed"] += 1
+                if accepted and batch.on_result:
+                    batch.on_result(key, result)
+            except Exception as e:
+                with self._condition:
+                    batch.errors[key] = e
+                    self.stats["failed"] += 1
+            finally:
+                with self._condition:
+                    batch.remaining -= 1
+                    if batch.remaining <= 0:
+                        batch.done.set()
+
+    # Runs fn(*args) for every (key, args) pair and blocks until everything finished or the timeout passed
+    # Returns a dictionary of key: result for the tasks that finished in time
+    # on_result(key, result) is called from the worker thread as each task finishes
+    def run(self, tasks, fn, timeout=5, on_result=None):
+        batch = LookupBatch(time.monotonic() + timeout, on_result)
+        for key, args in tasks:
+            batch.pending.append((key, fn, args))
+        batch.remaining = len(batch.pending)
+        if batch.remaining == 0:
+            return {}
+
+        self._ensure_started()
+        with self._condition:
+            self._batches.append(batch)
+            self._condition.notify_all()
+
+        batch.done.wait(timeout=timeout)
+
+        with self._condition:
+            # Cancels whatever hasn't started yet. Running tasks finish but their results are ignored
+            batch.cancelled = True
+            if batch.pending:
+                if batch in self._batches:
+                    self._batches.remove(batch)
+                self._drop_pending(batch)
+            for key, e in batch.errors.items():
+                print(f"Fetching Provider failed for {key}: {e}")
+            return dict(batch.results)
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                **self.stats,
+                "workers": self.max_workers,
+                "active_batches": len(self._batches),
+                "queued": sum(len(b.pending) for b in self._batches),
+            }
+
+
+# Shared by every blueprint that needs provider lookups
+provider_engine = ProviderLookupEngine(
+    max_workers=int(os.getenv("PY_PROVIDER_WORKERS", "6"))
+)
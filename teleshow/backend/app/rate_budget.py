@@ -0,0 +1,150 @@
+# Outbound rate budget shared by every worker process
+# The old ratelimit decorators counted calls per function and per process, so create_pool_with_discover counted
+# as one call while making up to seven, and running more than one worker multiplied the real rate.
+# This is a token bucket per upstream host kept in sqlite so every process takes from the same bucket.
+# It's charged by the upstream session for every HTTP request it actually sends (retries included).
+# Background work (calendar refreshes, index refreshes) can't take the last part of the bucket so
+# interactive requests like /search/details always go first.
+import contextlib
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# requests per second and burst size for each host. Can be changed with env variables
+HOST_LIMITS = {
+    "api.themoviedb.org": (
+        float(os.getenv("PY_TMDB_RATE", "20")),
+        float(os.getenv("PY_TMDB_BURST", "40")),
+    ),
+    "api.watchmode.com": (
+        float(os.getenv("PY_WATCHMODE_RATE", "2")),
+        float(os.getenv("PY_WATCHMODE_BURST", "10")),
+    ),
+}
+# Share of the bucket background requests have to leave for interactive ones
+BACKGROUND_RESERVE = 0.5
+# Longest a request will wait for a token before giving up
+MAX_WAIT = {INTERACTIVE: 10, BACKGROUND: 60}
+
+# Priority of the requests made by the current thread. Interactive unless something says otherwise
+current_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+
+
+# Used as: with background_priority(): ...
+@contextlib.contextmanager
+def background_priority():
+    token = current_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class RateBudgetExceeded(Exception):
+    pass
+
+
+class RateBudget:
+    def __init__(self, limits, filename="rate_budget.sqlite3"):
+        self.limits = limits
+        self.filename = filename
+        # sqlite connections can't be shared between threads so each thread gets its own
+        self._local = threading.local()
+        self.stats = {"granted": 0, "waited": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Imported here because extensions imports the upstream session which imports this module
+            from app.extensions import get_data_dir
+
+            # isolation_level=None lets BEGIN IMMEDIATE below lock the database across processes
+            conn = sqlite3.connect(
+                os.path.join(get_data_dir(), self.filename),
+                timeout=5,
+                isolation_level=None,
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (host TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    # Tries to take one token. Returns 0 if it got one, otherwise how long to wait before trying again
+    def _try_take(self, host, priority):
+        rate, burst = self.limits[host]
+        reserve = burst * BACKGROUND_RESERVE if priority == BACKGROUND else 0
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE host = ?", (host,)
+            ).fetchone()
+            tokens = burst if row is None else row[0]
+            if row is not None:
+                # Refills for the time since the last request
+                tokens = min(burst, tokens + (now - row[1]) * rate)
+
+            if tokens >= 1 + reserve:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 + reserve - tokens) / rate
+
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (host, tokens, now)
+            )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # Blocks until a token for the host is available
+    # Hosts without a limit aren't charged
+    def acquire(self, host, priority=None):
+        if host not in self.limits:
+            return
+        priority = priority or current_priority.get()
+        deadline = time.monotonic() + MAX_WAIT[priority]
+        waited = False
+        while True:
+            wait = self._try_take(host, priority)
+            if wait == 0:
+                with self._stats_lock:
+                    self.stats["granted"] += 1
+                    self.stats["waited"] += waited
+                return
+            if time.monotonic() + wait > deadline:
+                with self._stats_lock:
+                    self.stats["rejected"] += 1
+                raise RateBudgetExceeded(f"No rate budget left for {host}")
+            waited = True
+            time.sleep(min(wait, 0.25))
+
+    # Tokens left in each bucket as of now, refilled for the time since the last request
+    def get_levels(self):
+        rows = self._connect().execute("SELECT host, tokens, updated FROM buckets")
+        now = time.time()
+        levels = {}
+        for host, tokens, updated in rows.fetchall():
+            if host in self.limits:
+                rate, burst = self.limits[host]
+                levels[host] = round(min(burst, tokens + (now - updated) * rate), 2)
+        return levels
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["tokens"] = self.get_levels()
+        return stats
+
+
+rate_budget = RateBudget(HOST_LIMITS)
@@ -0,0 +1,150 @@
+# Written By Moses Pierre
+# Relevance scoring for search results
+# calculate_relevance scores one item at a time. It's kept as the reference version (and for the benchmark)
+# score_relevance does the same math for the whole candidate list in one pass with NumPy arrays
+import datetime
+import numpy as np
+
+# Weights for each part of the score. Same ones calculate_relevance uses
+TITLE_WEIGHT = 100
+RECENCY_WEIGHT = 20
+VOTE_WEIGHT = 15
+POPULARITY_WEIGHT = 10
+
+
+# FUNCTION FOR CALCULATING RELEVANCE FOR SEARCH RESULT SORTING
+def calculate_relevance(item, query):
+    title = item.get("title", "") or item.get("name", "")
+
+    if not title:
+        return 0
+
+    if (
+        item.get("popularity") < 3 and item.get("vote_count") < 20
+    ):  # If its been released and its not popular and doesn't have a lot of votes put on the bottom
+        return 0
+    # Makes sure that items with the query in the name get precidence
+    title = item.get("title", "") or item.get("name", "")
+
+    base_score = item.get("popularity", 0)
+
+    # Split query into words for partial matching
+    query_words = query.lower().split()
+
+    # Calculates title match score
+    title_match_score = 0
+
+    # Exact matches gets highest priority
+    if title.lower() == query.lower():
+        title_match_score = 10
+
+    # Partial matches where query is contained in title
+    elif query.lower() in title.lower():
+        title_match_score = 5
+    # Check for individual word matches
+    else:
+        word_matches = sum(1 for word in query_words if word in title.lower())
+        if word_matches > 0:
+            title_match_score = 2 * word_matches
+
+    # Consider release date for recency
+    release_date_score = 0
+    release_date = item.get("release_date") or item.get("first_air_date")
+    if release_date:
+        try:
+            year = int(release_date[:4])
+            current_year = datetime.datetime.now().year
+            years_old = current_year - year
+            release_date_score = max(
+                0, 1 - (years_old / 10)
+            )  # Newer content scores higher
+        except:
+            pass
+
+    # Vote average
+    vote_avg_score = item.get("vote_average", 0) / 10
+
+    # Calculate final score with title matches having higher weight than popularity
+    final_score = (
+        (title_match_score * 100)  # Title match has highest weight
+        + (release_date_score * 20)  # Recency has medium weight
+        + (vote_avg_score * 15)  # Rating quality has medium weight
+        + (base_score * 10)  # Popularity has lower weight
+    )
+
+    return final_score
+
+
+# Title match part of the score
+# Uses NumPy's vectorized string functions so the query is lowered once and every title is checked in C
+def _title_match_scores(titles, query):
+    query = query.lower()
+    titles = np.char.lower(titles)
+    # Check for individual word matches
+    word_matches = np.zeros(len(titles))
+    for word in query.split():
+        word_matches += np.char.find(titles, word) >= 0
+    scores = 2 * word_matches
+    # Partial matches where query is contained in title
+    scores[np.char.find(titles, query) >= 0] = 5
+    # Exact matches gets highest priority
+    scores[titles == query] = 10
+    return scores
+
+
+# Release year of each item or NaN when there isn't a usable date
+# Converting to a 4 character string array keeps just the year part of the date
+def _release_years(dates):
+    years = np.array(dates, dtype="U4")
+    valid = (np.char.str_len(years) == 4) & np.char.isdigit(years)
+    result = np.full(len(dates), np.nan)
+    result[valid] = years[valid].astype(int)
+    return result
+
+
+# BATCH RELEVANCE SCORING
+# Returns an array with the score of every item. Gives the same numbers as calculate_relevance
+def score_relevance(items, query):
+    if not items:
+        return np.zeros(0)
+
+    # Pulls out every field that's needed into flat lists, then into arrays
+    titles = np.array(
+        [item.get("title") or item.get("name") or "" for item in items], dtype=str
+    )
+    dates = [
+        item.get("release_date") or item.get("first_air_date") or "" for item in items
+    ]
+    popularity = np.array([item.get("popularity") or 0 for item in items], float)
+    vote_count = np.array([item.get("vote_count") or 0 for item in items], float)
+    vote_average = np.array([item.get("vote_average") or 0 for item in items], float)
+
+    # Newer content scores higher. Items without a date get 0
+    years_old = datetime.datetime.now().year - _release_years(dates)
+    release_date_score = np.nan_to_num(np.maximum(0, 1 - years_old / 10), nan=0.0)
+
+    scores = (
+        _title_match_scores(titles, query) * TITLE_WEIGHT
+        + release_date_score * RECENCY_WEIGHT
+        + (vote_average / 10) * VOTE_WEIGHT
+        + popularity * POPULARITY_WEIGHT
+    )
+
+    # Items with no title, or that aren't popular and don't have a lot of votes, go to the bottom
+    no_title = np.char.str_len(titles) == 0
+    unpopular = (popularity < 3) & (vote_count < 20)
+    scores[no_title | unpopular] = 0
+    return scores
+
+
+# Returns the items sorted by relevance, highest first
+# If k is given only the top k are returned. argpartition finds them without sorting the whole list
+# Ties keep their original order like sorted() does
+def rank_by_relevance(items, query, k=None):
+    scores = score_relevance(items, query)
+    if k is not None and k < len(items):
+        top = np.argpartition(-scores, k - 1)[:k]
+        order = top[np.lexsort((top, -scores[top]))]
+    else:
+        order = np.argsort(-scores, kind="stable")
+    return [items[i] for i in order]
@@ -0,0 +1,141 @@
+# NumPy version of the static sentence transformer model
+# static-similarity-mrl-multilingual-v1 is only a tokenizer and an embedding table. A sentence's embedding is
+# the mean of its tokens' rows (torch's EmbeddingBag in "mean" mode). Loading sentence_transformers pulled
+# in all of torch for that, which made startup slow and used a lot of memory.
+# Here the tokenizer comes from the tokenizers library and the table is a memory map of the model's
+# safetensors file, so only the rows that get used are read from disk.
+# encode() takes the same arguments the app used with SentenceTransformer.encode.
+import json
+import os
+import struct
+
+import numpy as np
+from tokenizers import Tokenizer
+
+# Only the files the static module needs are downloaded
+MODEL_FILES = ["modules.json", "*StaticEmbedding*", "*tokenizer.json", "*.safetensors"]
+
+SAFETENSORS_DTYPES = {"F32": np.float32, "F16": np.float16, "F64": np.float64}
+
+
+# Memory maps every tensor in a .safetensors file
+# The file is an 8 byte header length, a JSON header with each tensor's dtype, shape and byte range, then the data
+def load_safetensors(path):
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ValueError(f"Unsupported dtype {info['dtype']} for {name}")
+        start, end = info["data_offsets"]
+        shape = tuple(info["shape"])
+        if end == start:
+            tensors[name] = np.zeros(shape, dtype=dtype)
+            continue
+        tensors[name] = np.memmap(
+            path, dtype=dtype, mode="r", offset=8 + header_size + start, shape=shape
+        )
+    return tensors
+
+
+# Finds the model's folder. PY_MODEL_DIR points at a local copy (for the executable or offline use),
+# otherwise it comes from the Hugging Face cache and is downloaded the first time
+def find_model_dir(model_name):
+    model_dir = os.getenv("PY_MODEL_DIR")
+    if model_dir:
+        return model_dir
+    from huggingface_hub import snapshot_download
+
+    try:
+        return snapshot_download(model_name, allow_patterns=MODEL_FILES)
+    except Exception as e:
+        print(f"Couldn't check for model updates ({e}), using the cached copy")
+        return snapshot_download(
+            model_name, allow_patterns=MODEL_FILES, local_files_only=True
+        )
+
+
+class StaticEncoder:
+    def __init__(self, tokenizer, weights, normalize=False):
+        self.tokenizer = tokenizer
+        # Same as sentence_transformers' StaticEmbedding. Padding isn't needed for a mean
+        self.tokenizer.no_padding()
+        self.weights = weights
+        self.normalize = normalize
+
+    @classmethod
+    def load(cls, model_name):
+        model_dir = find_model_dir(model_name)
+        static_path = model_dir
+        normalize = False
+        # modules.json lists the model's layers. A sentence transformers static model is a
+        # StaticEmbedding folder, sometimes followed by a Normalize layer
+        modules_path = os.path.join(model_dir, "modules.json")
+        if os.path.exists(modules_path):
+            with open(modules_path, "r", encoding="utf-8") as f:
+                modules = json.load(f)
+            for module in modules:
+                if module["type"].endswith("StaticEmbedding"):
+                    static_path = os.path.join(model_dir, module["path"])
+                elif module["type"].endswith("Normalize"):
+                    normalize = True
+                else:
+                    raise ValueError(
+                        f"{model_name} has a {module['type']} layer, only static models are supported"
+                    )
+
+        tokenizer = Tokenizer.from_file(os.path.join(static_path, "tokenizer.json"))
+        tensors = load_safetensors(os.path.join(static_path, "model.safetensors"))
+        weights = tensors.get("embedding.weight")
+        if weights is None:
+            # Older exports name the table differently. It's the only 2D tensor either way
+            weights = next(t for t in tensors.values() if t.ndim == 2)
+        return cls(tokenizer, weights, normalize)
+
+    def get_sentence_embedding_dimension(self):
+        return self.weights.shape[1]
+
+    def encode(
+        self,
+        sentences,
+        batch_size=1024,
+        convert_to_numpy=True,
+        normalize_embeddings=False,
+        **kwargs,
+    ):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        embeddings = np.zeros((len(sentences), self.weights.shape[1]), dtype=np.float32)
+        # batch_size only limits how many token rows are gathered at once here
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start : start + batch_size]
+            embeddings[start : start + len(batch)] = self._encode_batch(batch)
+
+        if self.normalize or normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, sentences):
+        # Special tokens are left out, same as StaticEmbedding
+        encodings = self.tokenizer.encode_batch(sentences, add_special_tokens=False)
+        lengths = np.array([len(e.ids) for e in encodings], dtype=np.int64)
+        out = np.zeros((len(sentences), self.weights.shape[1]), dtype=np.float32)
+        if lengths.sum() == 0:
+            # Empty bags are zero vectors like in EmbeddingBag
+            return out
+        ids = np.fromiter(
+            (i for e in encodings for i in e.ids), dtype=np.int64, count=lengths.sum()
+        )
+        rows = np.asarray(self.weights[ids], dtype=np.float32)
+        # reduceat can't do empty segments so only the sentences that have tokens are summed
+        has_tokens = lengths > 0
+        starts = (np.cumsum(lengths) - lengths)[has_tokens]
+        sums = np.add.reduceat(rows, starts, axis=0)
+        out[has_tokens] = sums / lengths[has_tokens, None]
+        return out
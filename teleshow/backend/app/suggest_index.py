@@ -0,0 +1,177 @@
+# Prefix index for search box suggestions
+# Titles we've already seen in search, trending and details responses are kept in a sorted list.
+# A suggestion lookup is a binary search for the prefix and a short scan, no TMDB call needed.
+# The index only holds a bounded number of titles (the least popular are dropped first) and is saved to disk.
+import atexit
+import bisect
+import heapq
+import json
+import os
+import re
+import threading
+import unicodedata
+
+from app.extensions import get_data_dir
+
+# Leading words that people usually leave out when typing a title
+ARTICLES = ("the ", "a ", "an ")
+
+
+# Lowercases and removes accents so "Amélie" and "amelie" match
+# Punctuation becomes a space so "Spider-Man: No Way Home" matches "spider man"
+def normalize_title(title):
+    title = unicodedata.normalize("NFKD", title or "")
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"[^\w\s]", " ", title.lower())
+    return " ".join(title.split())
+
+
+class SuggestIndex:
+    def __init__(self, path, max_entries=50000, save_interval=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._lock = threading.RLock()
+        # media key -> suggestion dictionary
+        self._entries = {}
+        # Sorted list of (normalized title, media key). Titles with an article get a second entry without it
+        self._sorted = []
+        self._dirty = False
+        self._save_timer = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading suggestion index: {e}")
+            return
+        with self._lock:
+            for entry in entries:
+                self._insert(entry)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self._entries.values())
+            self._dirty = False
+        # Writes to a temporary file first so a crash can't leave a half written index
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving suggestion index: {e}")
+
+    def _schedule_save(self):
+        if self._save_timer is not None:
+            return
+
+        def run_save():
+            self._save_timer = None
+            self.save()
+
+        self._save_timer = threading.Timer(self.save_interval, run_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    @staticmethod
+    def _index_keys(normalized):
+        keys = [normalized]
+        for article in ARTICLES:
+            if normalized.startswith(article):
+                keys.append(normalized[len(article) :])
+        return keys
+
+    def _insert(self, entry):
+        key = f"{entry['media_type']}:{entry['id']}"
+        old = self._entries.get(key)
+        if old is not None:
+            # Title is already indexed. Only the popularity might have changed
+            if old["title"] == entry["title"]:
+                old.update(entry)
+                return
+            self._remove(key)
+        self._entries[key] = entry
+        for index_key in self._index_keys(normalize_title(entry["title"])):
+            bisect.insort(self._sorted, (index_key, key))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for index_key in self._index_keys(normalize_title(entry["title"])):
+            i = bisect.bisect_left(self._sorted, (index_key, key))
+            if i < len(self._sorted) and self._sorted[i] == (index_key, key):
+                del self._sorted[i]
+
+    # Drops the least popular titles once the index is over its limit
+    # Trims down to 90% so this doesn't run on every insert
+    def _evict(self):
+        if len(self._entries) <= self.max_entries:
+            return
+        keep = int(self.max_entries * 0.9)
+        drop = heapq.nsmallest(
+            len(self._entries) - keep,
+            self._entries.items(),
+            key=lambda kv: kv[1]["popularity"],
+        )
+        for key, _ in drop:
+            self._remove(key)
+
+    # Adds TMDB results (search, trending or details) to the index
+    def add_items(self, items, media_type=None):
+        with self._lock:
+            for item in items or []:
+                title = item.get("title") or item.get("name")
+                item_type = media_type or item.get("media_type")
+                if not title or item_type not in ("movie", "tv") or not item.get("id"):
+                    continue
+                date = item.get("release_date") or item.get("first_air_date") or ""
+                self._insert(
+                    {
+                        "id": item["id"],
+                        "media_type": item_type,
+                        "title": title,
+                        "year": date[:4],
+                        "poster_path": item.get("poster_path"),
+                        "popularity": item.get("popularity") or 0,
+                    }
+                )
+            self._evict()
+            self._dirty = True
+        self._schedule_save()
+
+    # Returns the most popular titles that start with the prefix
+    # scan_limit caps how many prefix matches are looked at for very short prefixes
+    def suggest(self, prefix, limit=8, scan_limit=2000):
+        prefix = normalize_title(prefix)
+        if not prefix:
+            return []
+        matches = {}
+        with self._lock:
+            i = bisect.bisect_left(self._sorted, (prefix, ""))
+            while i < len(self._sorted) and len(matches) < scan_limit:
+                index_key, key = self._sorted[i]
+                if not index_key.startswith(prefix):
+                    break
+                matches[key] = self._entries[key]
+                i += 1
+            return heapq.nlargest(
+                limit, matches.values(), key=lambda entry: entry["popularity"]
+            )
+
+    def get_stats(self):
+        with self._lock:
+            return {"titles": len(self._entries), "index_keys": len(self._sorted)}
+
+
+suggest_index = SuggestIndex(
+    os.path.join(get_data_dir(), "suggestions.json"),
+    max_entries=int(os.getenv("PY_SUGGEST_MAX_TITLES", "50000")),
+)
+# Saves anything that changed since the last save when the app closes
+atexit.register(suggest_index.save)
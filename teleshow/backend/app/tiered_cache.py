@@ -0,0 +1,313 @@
+# Two level cache backend for Flask-Caching
+# FileSystemCache opened, read and unpickled a file on every hit and rescanned the whole directory when pruning.
+#   L1 - in memory LRU bounded by bytes. Values are kept serialized so every hit gets its own copy
+#        (cached Response objects get changed by after_request handlers like compression and CORS)
+#   L2 - one sqlite file in the cache directory that survives restarts and is shared by every process
+# On a miss the first thread gets a lease on the key and the others wait for it to set the value
+# instead of all going to TMDB for the same thing at once.
+# Plugged in with CACHE_TYPE = "app.tiered_cache.TieredCache" so cache.cached and cache.memoize work as before.
+# Values are stored with the serializer in cache_serializer.py (msgpack + zstd). Pickled entries from before
+# are read as they are and rewritten in the new format the first time they're read from sqlite.
+# FileSystemCache's files can't be moved over (their names are hashes of the keys) so they're deleted on startup.
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask_caching.backends.base import BaseCache
+
+from app.cache_serializer import CacheSerializer
+
+# sqlite is pruned once every this many sets instead of on every set
+PRUNE_INTERVAL = 100
+
+# FileSystemCache names each entry with the md5 of its key and keeps a count in __wz_cache_count
+FILESYSTEM_CACHE_FILE = re.compile(r"^([0-9a-f]{32}|__wz_cache_count)$")
+
+
+# Deletes the files FileSystemCache left in the cache directory. Nothing reads them anymore
+def remove_filesystem_cache_files(cache_dir):
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if not FILESYSTEM_CACHE_FILE.match(name):
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+        except OSError as e:
+            print(f"Error removing old cache file {name}: {e}")
+    if removed:
+        print(f"Removed {removed} old FileSystemCache files")
+    return removed
+
+
+class TieredCache(BaseCache):
+    def __init__(
+        self,
+        path,
+        default_timeout=300,
+        threshold=5000,
+        l1_max_bytes=64 * 1024 * 1024,
+        lease_timeout=10,
+        serializer=None,
+        ignore_delete_many_errors=False,
+    ):
+        super().__init__(default_timeout, ignore_delete_many_errors)
+        self.path = path
+        self.threshold = threshold
+        self.l1_max_bytes = l1_max_bytes
+        # How long other threads wait on a lease before computing the value themselves
+        self.lease_timeout = lease_timeout
+        # Anything with dumps and loads works. Flask-Caching's CACHE_SERIALIZER replaces it too
+        self.serializer = serializer or CacheSerializer(os.path.dirname(path))
+
+        self._lock = threading.Lock()
+        # Notified whenever a lease is released so waiting threads can check again
+        self._lease_released = threading.Condition(self._lock)
+        self._l1 = OrderedDict()  # key -> (expires, serialized value)
+        self._l1_bytes = 0
+        self._leases = {}  # key -> (thread id, monotonic time the lease runs out)
+        self._sets_since_prune = 0
+        # sqlite connections can't be shared between threads so each thread gets its own
+        self._local = threading.local()
+        self.stats = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "lease_waits": 0,
+            "l1_evictions": 0,
+            "migrated": 0,
+            "unreadable": 0,
+        }
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)"
+        )
+        conn.commit()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs["threshold"] = config["CACHE_THRESHOLD"]
+        remove_filesystem_cache_files(config["CACHE_DIR"])
+        cache = cls(os.path.join(config["CACHE_DIR"], "cache.sqlite3"), *args, **kwargs)
+
+        # A view that didn't set its key (error, or a response filter said no) gives its leases up when the request ends
+        @app.teardown_request
+        def release_cache_leases(exc):
+            cache.release_thread_leases()
+
+        return cache
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL lets readers keep going while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        # A timeout of 0 means the entry never expires
+        return 0 if timeout == 0 else time.time() + timeout
+
+    @staticmethod
+    def _is_live(expires):
+        return expires == 0 or expires > time.time()
+
+    # Has to be called with the lock held
+    def _put_l1(self, key, expires, data):
+        old = self._l1.pop(key, None)
+        if old is not None:
+            self._l1_bytes -= len(old[1])
+        # Very large values would push most of L1 out so they're only kept in sqlite
+        if len(data) > self.l1_max_bytes // 4:
+            return
+        self._l1[key] = (expires, data)
+        self._l1_bytes += len(data)
+        while self._l1_bytes > self.l1_max_bytes:
+            _, (_, evicted) = self._l1.popitem(last=False)
+            self._l1_bytes -= len(evicted)
+            self.stats["l1_evictions"] += 1
+
+    # Has to be called with the lock held
+    def _drop_l1(self, key):
+        old = self._l1.pop(key, None)
+        if old is not None:
+            self._l1_bytes -= len(old[1])
+
+    # Has to be called with the lock held
+    def _release(self, key):
+        if self._leases.pop(key, None) is not None:
+            self._lease_released.notify_all()
+
+    # Returns the serialized value from L1 or L2, or None
+    def _read(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                if self._is_live(entry[0]):
+                    self._l1.move_to_end(key)
+                    self.stats["l1_hits"] += 1
+                    return entry[1]
+                self._drop_l1(key)
+
+        row = (
+            self._connect()
+            .execute("SELECT value, expires FROM cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None or not self._is_live(row[1]):
+            return None
+        data = row[0]
+        is_legacy = getattr(self.serializer, "is_legacy", None)
+        if is_legacy is not None and is_legacy(data):
+            data = self._migrate(key, data)
+        with self._lock:
+            # Used again soon most likely so it's moved up to L1
+            self._put_l1(key, row[1], data)
+            self.stats["l2_hits"] += 1
+        return data
+
+    # Rewrites an entry from the old pickle format in the current one
+    def _migrate(self, key, data):
+        data = self.serializer.dumps(self.serializer.loads(data))
+        conn = self._connect()
+        conn.execute("UPDATE cache SET value = ? WHERE key = ?", (data, key))
+        conn.commit()
+        with self._lock:
+            self.stats["migrated"] += 1
+        return data
+
+    def get(self, key):
+        while True:
+            try:
+                data = self._read(key)
+                if data is not None:
+                    return self.serializer.loads(data)
+            except Exception as e:
+                # Corrupt entry or one compressed with a dictionary that's gone. Treated as a miss
+                print(f"Error reading cache entry {key}: {e}")
+                with self._lock:
+                    self.stats["unreadable"] += 1
+                self.delete(key)
+
+            with self._lock:
+                me = threading.get_ident()
+                now = time.monotonic()
+                lease = self._leases.get(key)
+                if lease is None or lease[0] == me or lease[1] <= now:
+                    # This thread is the one that computes the value. set() releases the lease
+                    self._leases[key] = (me, now + self.lease_timeout)
+                    self.stats["misses"] += 1
+                    return None
+                # Another thread is already computing it. Waits for it and reads again
+                self.stats["lease_waits"] += 1
+                self._lease_released.wait(lease[1] - now)
+
+    # Checks for the key without taking a lease. Used for lookups that don't set the key on a miss
+    def has(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None and self._is_live(entry[0]):
+                return True
+        row = (
+            self._connect()
+            .execute("SELECT expires FROM cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row is not None and self._is_live(row[0])
+
+    def set(self, key, value, timeout=None):
+        expires = self._expires(timeout)
+        data = self.serializer.dumps(value)
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, data, expires)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing to cache: {e}")
+            with self._lock:
+                self._release(key)
+            return False
+
+        with self._lock:
+            self._put_l1(key, expires, data)
+            self._release(key)
+            self._sets_since_prune += 1
+            prune = self._sets_since_prune >= PRUNE_INTERVAL
+            if prune:
+                self._sets_since_prune = 0
+        if prune:
+            self._prune()
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            self._drop_l1(key)
+            self._release(key)
+        conn = self._connect()
+        deleted = conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+        conn.commit()
+        return deleted > 0
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._l1_bytes = 0
+        conn = self._connect()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+        return True
+
+    # Removes expired entries, then the ones closest to expiring until sqlite is back under the threshold
+    def _prune(self):
+        conn = self._connect()
+        conn.execute(
+            "DELETE FROM cache WHERE expires != 0 AND expires <= ?", (time.time(),)
+        )
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self.threshold:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires = 0, expires LIMIT ?)",
+                (count - self.threshold,),
+            )
+        conn.commit()
+
+    # Gives up the lease on a key that the caller isn't going to set
+    def release(self, key):
+        with self._lock:
+            self._release(key)
+
+    # Gives up every lease the current thread still holds
+    def release_thread_leases(self):
+        me = threading.get_ident()
+        with self._lock:
+            keys = [key for key, lease in self._leases.items() if lease[0] == me]
+            for key in keys:
+                self._release(key)
+
+    def get_stats(self):
+        with self._lock:
+            stats = {
+                **self.stats,
+                "l1_entries": len(self._l1),
+                "l1_bytes": self._l1_bytes,
+                "leases": len(self._leases),
+            }
+        stats["l2_entries"] = (
+            self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        )
+        return stats
@@ -0,0 +1,238 @@
+# One HTTP client for every TMDB and Watchmode call
+# Before this each call opened its own connection (bare requests.get, and tmdbsimple sends "Connection: close"),
+# so every cache miss paid for a new TCP and TLS handshake. This session keeps connection pools to both APIs,
+# sets timeouts and retries per endpoint and records latency and status code histograms.
+# tmdbsimple is pointed at it in extensions.init_app with tmdb.REQUESTS_SESSION.
+# Every request it sends (retries too) takes a token from the shared rate budget first.
+# A circuit breaker per host stops calls to an API that keeps failing so callers can serve stale data right away.
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.rate_budget import rate_budget
+
+TMDB_HOST = "api.themoviedb.org"
+WATCHMODE_HOST = "api.watchmode.com"
+
+# (connect, read) timeouts in seconds. First matching pattern wins, patterns are matched against host + path
+ENDPOINT_TIMEOUTS = [
+    (r"api\.themoviedb\.org/3/(movie|tv)/\d+/watch/providers", (3.05, 5)),
+    (r"api\.themoviedb\.org/3/search/", (3.05, 6)),
+    (r"api\.themoviedb\.org/3/discover/", (3.05, 10)),
+    (r"api\.themoviedb\.org/", (3.05, 10)),
+    (r"api\.watchmode\.com/datasets/", (3.05, 120)),
+    (r"api\.watchmode\.com/", (3.05, 8)),
+]
+DEFAULT_TIMEOUT = (3.05, 15)
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS = [25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf")]
+
+
+# Groups urls into endpoints for the stats. Ids are replaced so /movie/550 and /movie/551 count together
+# The first segment is skipped so TMDB's /3 version prefix stays
+def endpoint_label(url):
+    parts = urlsplit(url)
+    path = re.sub(r"(?<=.)/\d+(?=/|$)", "/{id}", parts.path)
+    return f"{parts.netloc}{path}"
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.latency = [0] * len(LATENCY_BUCKETS)
+        self.status = {}
+
+    def record(self, elapsed_ms, status):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed_ms <= bound:
+                self.latency[i] += 1
+                break
+        if status is None:
+            self.errors += 1
+        else:
+            self.status[status] = self.status.get(status, 0) + 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0,
+            "latency_ms": {
+                ("inf" if bound == float("inf") else str(bound)): n
+                for bound, n in zip(LATENCY_BUCKETS, self.latency)
+            },
+            "status": {str(code): n for code, n in self.status.items()},
+        }
+
+
+# Retry that takes a rate budget token before each retry so retries count against the budget like any other request
+class BudgetedRetry(Retry):
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None,
+    ):
+        new_retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if _pool is not None:
+            rate_budget.acquire(_pool.host)
+        return new_retry
+
+
+# Raised instead of sending a request while the host's circuit is open
+# It's a ConnectionError so code that already handles network failures handles it too
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+# Opens after failure_threshold failures in a row (5xx after retries, timeouts, connection errors)
+# While open every call fails right away. After reset_timeout one trial call is let through:
+# if it works the circuit closes, if not it stays open for another reset_timeout
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = {}  # host -> failures in a row
+        self._opened_at = {}  # host -> time the circuit opened
+        self._trial_running = set()
+
+    def allow(self, host):
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return True
+            if time.monotonic() - opened_at < self.reset_timeout:
+                return False
+            if host in self._trial_running:
+                return False
+            self._trial_running.add(host)
+            return True
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trial_running.discard(host)
+
+    def record_failure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if host in self._trial_running or failures >= self.failure_threshold:
+                if host not in self._opened_at:
+                    print(f"Circuit opened for {host} after {failures} failures")
+                self._opened_at[host] = time.monotonic()
+            self._trial_running.discard(host)
+
+    def cancel_trial(self, host):
+        with self._lock:
+            self._trial_running.discard(host)
+
+    def is_open(self, host):
+        with self._lock:
+            return host in self._opened_at
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                host: {
+                    "open": host in self._opened_at,
+                    "failures": self._failures.get(host, 0),
+                }
+                for host in set(self._failures) | set(self._opened_at)
+            }
+
+
+class UpstreamSession(requests.Session):
+    def __init__(self, pool_size=20, retries=2):
+        super().__init__()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        self.breaker = CircuitBreaker()
+
+        # Retries connection errors and the status codes that mean "try again later"
+        # Retry-After from a 429 is respected
+        retry = BudgetedRetry(
+            total=retries,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount(f"https://{TMDB_HOST}/", adapter)
+        self.mount(f"https://{WATCHMODE_HOST}/", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = get_timeout(url)
+        # tmdbsimple asks for the connection to be closed after every call which defeats the pool
+        headers = kwargs.get("headers")
+        if headers and headers.get("Connection") == "close":
+            kwargs["headers"] = {k: v for k, v in headers.items() if k != "Connection"}
+
+        host = urlsplit(url).hostname
+        if not self.breaker.allow(host):
+            raise CircuitOpenError(f"Circuit open for {host}, not calling {url}")
+        # Waits for the host's rate budget. Raises RateBudgetExceeded if it doesn't free up in time
+        try:
+            rate_budget.acquire(host)
+        except Exception:
+            # Nothing was sent so this doesn't count for or against the host
+            self.breaker.cancel_trial(host)
+            raise
+
+        start = time.perf_counter()
+        status = None
+        try:
+            response = super().request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            if status is None or status >= 500:
+                self.breaker.record_failure(host)
+            else:
+                self.breaker.record_success(host)
+            self._record(url, (time.perf_counter() - start) * 1000, status)
+
+    def _record(self, url, elapsed_ms, status):
+        label = endpoint_label(url)
+        with self._stats_lock:
+            stats = self._stats.get(label)
+            if stats is None:
+                stats = self._stats[label] = EndpointStats()
+            stats.record(elapsed_ms, status)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return {label: stats.to_dict() for label, stats in self._stats.items()}
+
+
+def get_timeout(url):
+    parts = urlsplit(url)
+    target = f"{parts.netloc}{parts.path}"
+    for pattern, timeout in ENDPOINT_TIMEOUTS:
+        if re.match(pattern, target):
+            return timeout
+    return DEFAULT_TIMEOUT
+
+
+# Shared by every TMDB and Watchmode call in the app
+upstream_session = UpstreamSession()
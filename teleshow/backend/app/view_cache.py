@@ -0,0 +1,348 @@
+# Stale-while-revalidate caching for views and TMDB helpers
+# With cache.cached and cache.memoize an entry just disappears when it expires, so the first user after that
+# waits on every TMDB call again, and if TMDB is down every expired key fails.
+# Here every entry has two ages:
+#   soft_ttl - fresh until then. After it the cached value is still returned right away
+#              and one background refresh is started for the key
+#   hard_ttl - the entry is deleted. This is how old a value can get when refreshes keep failing
+# Refreshes aren't started while the upstream circuit is open. The stale value keeps being served instead.
+# Cached views also keep gzip and brotli copies of the body made once when the entry is stored.
+# A hit sends the copy the client accepts as is, so flask_compress doesn't compress the same JSON on every request.
+# A request that stores an entry only uses fast settings. The smallest copies are made afterwards in the background.
+# The body's ETag is stored with them so If-None-Match gets a 304 straight from the cache entry.
+import functools
+import gzip
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from flask import (
+    request,
+    make_response,
+    copy_current_request_context,
+    g,
+    current_app,
+)
+
+from app.extensions import cache
+from app.etags import body_etag, matching_etag, not_modified, set_etag
+from app.rate_budget import background_priority
+from app.upstream import upstream_session, TMDB_HOST
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Background refreshes for every stale entry run here
+refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="swr-refresh")
+# Keys being refreshed right now so a busy stale key only gets one refresh
+refreshing = set()
+refreshing_lock = threading.Lock()
+
+# Settings used while a request is waiting on the response (brotli 11 takes over half a second on a big body)
+FAST_GZIP_LEVEL = 6
+FAST_BROTLI_QUALITY = 5
+# Compression only happens once per stored entry so off the request the slowest, smallest settings are used
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Recompresses entries stored by requests with the smallest settings
+recompress_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="swr-recompress"
+)
+
+stats = {
+    "fresh_hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "refreshes": 0,
+    "refresh_failures": 0,
+    "skipped_circuit_open": 0,
+    "precompressed_hits": 0,
+    "recompressed": 0,
+    "not_modified": 0,
+}
+stats_lock = threading.Lock()
+
+
+def count(stat):
+    with stats_lock:
+        stats[stat] += 1
+
+
+def get_stats():
+    with stats_lock:
+        return dict(stats)
+
+
+# Gives up the tiered cache's lease on a key that isn't going to be set after all
+def release_lease(key):
+    release = getattr(cache.cache, "release", None)
+    if release is not None:
+        release(key)
+
+
+def store(key, value, soft_ttl, hard_ttl, encodings=None, etag=None):
+    entry = {"value": value, "fresh_until": time.time() + soft_ttl}
+    if encodings:
+        entry["encodings"] = encodings
+    if etag:
+        entry["etag"] = etag
+    cache.set(key, entry, timeout=hard_ttl)
+
+
+# Stores a view's response with its compressed copies and ETag. Returns the entry
+# Background refreshes compress with the smallest settings right away. A request uses the fast ones
+# and the entry gets smaller copies from the recompress thread
+def store_response(key, response, soft_ttl, hard_ttl):
+    refreshing = is_refreshing()
+    if refreshing:
+        encodings = compress_response(response, BROTLI_QUALITY, GZIP_LEVEL)
+    else:
+        encodings = compress_response(response, FAST_BROTLI_QUALITY, FAST_GZIP_LEVEL)
+    body = response.get_data()
+    etag = body_etag(body)
+    store(key, response, soft_ttl, hard_ttl, encodings, etag)
+    if encodings and not refreshing:
+        app = current_app._get_current_object()
+        expires = time.time() + hard_ttl
+        recompress_executor.submit(
+            recompress_entry, app, key, body, etag, list(encodings), expires
+        )
+    return {"value": response, "encodings": encodings, "etag": etag}
+
+
+# Replaces an entry's compressed copies with the smallest ones, as long as the entry still has the same body
+def recompress_entry(app, key, body, etag, names, expires):
+    try:
+        encodings = compress_body(body, names, BROTLI_QUALITY, GZIP_LEVEL)
+        with app.app_context():
+            entry = cache.get(key)
+            if entry is None:
+                # Expired or deleted. The tiered cache gave this thread a lease on the miss
+                release_lease(key)
+                return
+            timeout = expires - time.time()
+            if entry.get("etag") != etag or timeout <= 0:
+                return
+            entry["encodings"] = encodings
+            cache.set(key, entry, timeout=timeout)
+        count("recompressed")
+    except Exception as e:
+        print(f"Error recompressing {key}: {e}")
+
+
+# Returns the cached entry or None, and starts a refresh if it's stale
+# make_refresh is only called for stale entries and returns the function the refresh thread runs
+def lookup(key, make_refresh, host):
+    entry = cache.get(key)
+    if entry is None:
+        count("misses")
+        return None
+    if time.time() < entry["fresh_until"]:
+        count("fresh_hits")
+    else:
+        count("stale_hits")
+        schedule_refresh(key, make_refresh, host)
+    return entry
+
+
+# Compressed copies of a response body, best first. Uses the same mimetypes and minimum size as flask_compress
+# SWR_PRECOMPRESS = False turns it off and leaves every hit to flask_compress
+def compress_response(response, brotli_quality, gzip_level):
+    config = current_app.config
+    if not config.get("SWR_PRECOMPRESS", True):
+        return {}
+    if response.mimetype not in config.get("COMPRESS_MIMETYPES", ()):
+        return {}
+    body = response.get_data()
+    if len(body) < config.get("COMPRESS_MIN_SIZE", 500):
+        return {}
+    names = ["gzip"] if brotli is None else ["br", "gzip"]
+    return compress_body(body, names, brotli_quality, gzip_level)
+
+
+def compress_body(body, names, brotli_quality, gzip_level):
+    encodings = {}
+    if "br" in names:
+        encodings["br"] = brotli.compress(body, quality=brotli_quality)
+    if "gzip" in names:
+        # mtime=0 so the same body always gives the same bytes
+        encodings["gzip"] = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return encodings
+
+
+# Swaps in the stored copy the client accepts. flask_compress leaves responses with a Content-Encoding alone
+# Returns the encoding used or None
+def send_encoded(response, encodings):
+    # with_fields_param needs the plain JSON to trim, and flask_compress compresses what it returns
+    if not encodings or request.args.get("fields"):
+        return None
+    if "Content-Encoding" in response.headers:
+        return None
+    encoding = request.accept_encodings.best_match(list(encodings))
+    if encoding is None:
+        return None
+    response.set_data(encodings[encoding])
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    count("precompressed_hits")
+    return encoding
+
+
+# The ETag of what this request gets from the entry. A fields= response is a different body so it gets its own tag
+def view_etag(entry):
+    # Entries stored before ETags existed get one from their body
+    etag = entry.get("etag") or body_etag(entry["value"].get_data())
+    fields_param = request.args.get("fields")
+    if fields_param:
+        etag += "-" + hashlib.md5(fields_param.encode("utf-8")).hexdigest()[:8]
+    return etag
+
+
+# Sends a cached entry, or a 304 if the client already has it
+def send_entry(entry):
+    etag = view_etag(entry)
+    matched = matching_etag(etag)
+    if matched:
+        count("not_modified")
+        return not_modified(matched)
+    response = entry["value"]
+    encoding = send_encoded(response, entry.get("encodings"))
+    # Same "tag:encoding" form flask_compress uses for the bodies it compresses
+    return set_etag(response, f"{etag}:{encoding}" if encoding else etag)
+
+
+def schedule_refresh(key, make_refresh, host):
+    # No point asking an upstream that's down. The stale value is served until it comes back
+    if upstream_session.breaker.is_open(host):
+        count("skipped_circuit_open")
+        return
+    with refreshing_lock:
+        if key in refreshing:
+            return
+        refreshing.add(key)
+    refresh_fn = make_refresh()
+
+    def run_refresh():
+        try:
+            # Refreshes are background work and only get the spare part of the rate budget
+            with background_priority():
+                refresh_fn()
+            count("refreshes")
+        except Exception as e:
+            count("refresh_failures")
+            print(f"Error refreshing {key}: {e}")
+        finally:
+            with refreshing_lock:
+                refreshing.discard(key)
+
+    refresh_executor.submit(run_refresh)
+
+
+# True inside a background view refresh. Views use it to skip things only a real client needs (like streaming)
+def is_refreshing():
+    return g.get("swr_refreshing", False)
+
+
+# fields= is left out since it's applied after the cache (see projection.with_fields_param)
+def default_view_key():
+    args = urlencode(
+        sorted((k, v) for k, v in request.args.items(multi=True) if k != "fields")
+    )
+    return f"swr-view{request.path}?{args}"
+
+
+# Only complete successful answers are cached. The views return {"error": ...} with a 200 in places
+def is_cacheable_response(response):
+    if response.status_code != 200 or response.is_streamed:
+        return False
+    if response.is_json:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict) and "error" in body:
+            return False
+    return True
+
+
+# Used like cache.cached. make_cache_key and response_filter work the same way
+# The decorated view gets a store(key, response) function for responses saved outside the view (streaming search)
+def swr_cached(
+    soft_ttl, hard_ttl, make_cache_key=None, response_filter=None, host=TMDB_HOST
+):
+    def decorator(f):
+        def render(key, args, kwargs):
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                release_lease(key)
+                raise
+            if is_cacheable_response(response) and (
+                response_filter is None or response_filter(response)
+            ):
+                return send_entry(store_response(key, response, soft_ttl, hard_ttl))
+            release_lease(key)
+            return response
+
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = make_cache_key() if make_cache_key else default_view_key()
+
+            # The refresh runs the view again with a copy of this request
+            def make_refresh():
+                @copy_current_request_context
+                def refresh():
+                    g.swr_refreshing = True
+                    render(key, args, kwargs)
+
+                return refresh
+
+            entry = lookup(key, make_refresh, host)
+            if entry is not None:
+                return send_entry(entry)
+            return render(key, args, kwargs)
+
+        decorated_function.store = lambda key, response: store_response(
+            key, response, soft_ttl, hard_ttl
+        )
+        return decorated_function
+
+    return decorator
+
+
+# Used like cache.memoize. Arguments are turned into the key with repr() so lists work too
+# Exceptions aren't cached and None isn't either (same as memoize)
+def swr_memoize(soft_ttl, hard_ttl, host=TMDB_HOST):
+    def decorator(f):
+        name = f"{f.__module__}.{f.__qualname__}"
+
+        def load(key, args, kwargs):
+            try:
+                value = f(*args, **kwargs)
+            except Exception:
+                release_lease(key)
+                raise
+            if value is None:
+                release_lease(key)
+            else:
+                store(key, value, soft_ttl, hard_ttl)
+            return value
+
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            arg_hash = hashlib.md5(
+                repr((args, sorted(kwargs.items()))).encode("utf-8")
+            ).hexdigest()
+            key = f"swr-memo-{name}-{arg_hash}"
+            entry = lookup(
+                key, lambda: functools.partial(load, key, args, kwargs), host
+            )
+            if entry is not None:
+                return entry["value"]
+            return load(key, args, kwargs)
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,114 @@
+# Local table that maps TMDB ids to Watchmode title ids
+# watchmode_search used to spend a whole /search/ call just to turn a TMDB id into a Watchmode id.
+# That mapping never changes so it's saved here. It fills up from live lookups and can be bulk loaded
+# from Watchmode's published id mapping file:
+#   python -m app.watchmode_ids https://api.watchmode.com/datasets/title_id_map.csv
+import csv
+import io
+import os
+import sqlite3
+import sys
+import threading
+
+from app.extensions import get_data_dir
+from app.upstream import upstream_session
+
+WATCHMODE_ID_MAP_URL = "https://api.watchmode.com/datasets/title_id_map.csv"
+
+
+class WatchmodeIdMap:
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS title_ids (
+                tmdb_type TEXT,
+                tmdb_id INTEGER,
+                watchmode_id INTEGER,
+                PRIMARY KEY (tmdb_type, tmdb_id)
+            )""")
+        self._conn.commit()
+
+    def get(self, tmdb_type, tmdb_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT watchmode_id FROM title_ids WHERE tmdb_type = ? AND tmdb_id = ?",
+                (tmdb_type, int(tmdb_id)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, tmdb_type, tmdb_id, watchmode_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO title_ids VALUES (?, ?, ?)",
+                (tmdb_type, int(tmdb_id), int(watchmode_id)),
+            )
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM title_ids").fetchone()[0]
+
+    # Loads Watchmode's id mapping csv from a file path or url
+    # Columns: "Watchmode ID","IMDB ID","TMDB ID","TMDB Type","Title","Year"
+    def load_mapping_file(self, source, batch_size=5000):
+        if source.startswith("http"):
+            response = upstream_session.get(source)
+            response.raise_for_status()
+            reader = csv.DictReader(io.StringIO(response.content.decode("utf-8-sig")))
+            return self._load_rows(reader, batch_size)
+        with open(source, "r", encoding="utf-8-sig", newline="") as f:
+            return self._load_rows(csv.DictReader(f), batch_size)
+
+    def _load_rows(self, reader, batch_size):
+        loaded = 0
+        batch = []
+        for row in reader:
+            tmdb_id = row.get("TMDB ID")
+            tmdb_type = row.get("TMDB Type")
+            watchmode_id = row.get("Watchmode ID")
+            if not tmdb_id or tmdb_type not in ("movie", "tv") or not watchmode_id:
+                continue
+            try:
+                batch.append((tmdb_type, int(tmdb_id), int(watchmode_id)))
+            except ValueError:
+                continue
+            if len(batch) >= batch_size:
+                loaded += self._insert_batch(batch)
+                batch = []
+        if batch:
+            loaded += self._insert_batch(batch)
+        return loaded
+
+    def _insert_batch(self, batch):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO title_ids VALUES (?, ?, ?)", batch
+            )
+            self._conn.commit()
+        return len(batch)
+
+
+watchmode_id_map = WatchmodeIdMap(os.path.join(get_data_dir(), "watchmode_ids.sqlite3"))
+
+
+# If PY_WATCHMODE_ID_MAP is set (path or url) and the table is empty it gets loaded in the background on startup
+def load_mapping_on_startup():
+    source = os.getenv("PY_WATCHMODE_ID_MAP")
+    if not source or watchmode_id_map.count() > 0:
+        return
+
+    def load_task():
+        try:
+            loaded = watchmode_id_map.load_mapping_file(source)
+            print(f"Loaded {loaded} Watchmode id mappings")
+        except Exception as e:
+            print(f"Error loading Watchmode id mappings: {e}")
+
+    loader = threading.Thread(target=load_task, name="watchmode-id-loader")
+    loader.daemon = True
+    loader.start()
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else WATCHMODE_ID_MAP_URL
+    print(f"Loaded {watchmode_id_map.load_mapping_file(source)} Watchmode id mappings")
@@ -0,0 +1,183 @@
+# Ledger for the Watchmode monthly quota
+# Watchmode stops answering once the monthly quota is used up, so every call is counted here and saved to sqlite.
+# When Watchmode sends its X-Account-Quota headers the count is synced to their numbers.
+# The burn rate so far is projected to the end of the month and the app degrades in steps as the quota runs low:
+#   0 normal     - sources cached for an hour like before
+#   1 extend     - sources cached for a day
+#   2 stale      - the last sources we got for a title are served no matter how old, only new titles call Watchmode
+#   3 tmdb_only  - Watchmode isn't called at all, sources are built from TMDB's provider data
+import calendar
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from app.extensions import get_data_dir
+
+NORMAL = 0
+EXTEND = 1
+STALE = 2
+TMDB_ONLY = 3
+LEVEL_NAMES = ["normal", "extend", "stale", "tmdb_only"]
+
+# How long fetched sources are cached at each level
+SOURCE_TTLS = {NORMAL: 3600, EXTEND: 86400, STALE: 7 * 86400, TMDB_ONLY: 7 * 86400}
+# Share of the quota left when each level starts
+EXTEND_BELOW = 0.4
+STALE_BELOW = 0.15
+
+
+def current_month():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m")
+
+
+# True when a 429 says the monthly quota is used up. Watchmode also sends 429 for going over the per second
+# limit, and that one only means slow down, so the error message has to mention the quota
+def is_monthly_quota_error(response):
+    if response is None or response.status_code != 429:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    message = str(body.get("statusMessage") or body.get("message") or "").lower()
+    return "quota" in message
+
+
+class WatchmodeQuota:
+    def __init__(self, db_path, monthly_quota=1000, reserve=20):
+        self.monthly_quota = monthly_quota
+        # Calls kept back for when the quota is nearly gone. Only TMDB data is used once we're down to these
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS usage (
+                month TEXT PRIMARY KEY,
+                used INTEGER,
+                quota INTEGER,
+                synced_at REAL
+            )""")
+        # Last sources Watchmode gave for each title. Served when the quota is too low to ask again
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS last_sources (
+                key TEXT PRIMARY KEY,
+                sources TEXT,
+                fetched_at REAL
+            )""")
+        self._conn.commit()
+
+    def _usage(self, month):
+        row = self._conn.execute(
+            "SELECT used, quota, synced_at FROM usage WHERE month = ?", (month,)
+        ).fetchone()
+        if row is None:
+            return 0, self.monthly_quota, None
+        return row
+
+    # Counts one Watchmode call. If the response has the quota headers those numbers replace our own count
+    def record_call(self, response=None):
+        month = current_month()
+        headers = response.headers if response is not None else {}
+        quota = headers.get("X-Account-Quota")
+        used = headers.get("X-Account-Quota-Used")
+        with self._lock:
+            if quota is not None and used is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?)",
+                        (month, int(used), int(quota), time.time()),
+                    )
+                    self._conn.commit()
+                    return
+                except ValueError:
+                    pass
+            # The increment is done in SQL so other processes counting at the same time aren't overwritten
+            self._conn.execute(
+                "INSERT OR IGNORE INTO usage VALUES (?, 0, ?, NULL)",
+                (month, self.monthly_quota),
+            )
+            # Watchmode has already cut us off for the month. Any other 429 is counted like a normal call
+            if is_monthly_quota_error(response):
+                self._conn.execute(
+                    "UPDATE usage SET used = quota WHERE month = ?", (month,)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE usage SET used = used + 1 WHERE month = ?", (month,)
+                )
+            self._conn.commit()
+
+    def get_budget(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        month = now.strftime("%Y-%m")
+        with self._lock:
+            used, quota, synced_at = self._usage(month)
+
+        days_in_month = calendar.monthrange(now.year, now.month)[1]
+        # At least a day has "passed" so a few calls on the 1st don't project to thousands
+        elapsed_days = max(
+            1.0,
+            now.day - 1 + (now.hour * 3600 + now.minute * 60 + now.second) / 86400,
+        )
+        burn_rate = used / elapsed_days
+        projected = round(burn_rate * days_in_month)
+        remaining = max(0, quota - used)
+
+        if remaining <= self.reserve:
+            level = TMDB_ONLY
+        elif remaining < quota * STALE_BELOW:
+            level = STALE
+        elif remaining < quota * EXTEND_BELOW or projected > quota:
+            level = EXTEND
+        else:
+            level = NORMAL
+
+        return {
+            "month": month,
+            "quota": quota,
+            "used": used,
+            "remaining": remaining,
+            "reserve": self.reserve,
+            "burn_rate_per_day": round(burn_rate, 2),
+            "projected_month_total": projected,
+            # Day of the month the quota runs out at the current rate. None if it won't this month
+            "exhausted_on_day": (
+                min(days_in_month, int(quota / burn_rate) + 1)
+                if projected > quota
+                else None
+            ),
+            "level": level,
+            "level_name": LEVEL_NAMES[level],
+            "source_ttl": SOURCE_TTLS[level],
+            "synced_at": synced_at,
+        }
+
+    def get_level(self):
+        return self.get_budget()["level"]
+
+    def save_sources(self, key, sources):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO last_sources VALUES (?, ?, ?)",
+                (key, json.dumps(sources), time.time()),
+            )
+            self._conn.commit()
+
+    # Returns the last sources saved for the title or None
+    def get_stale_sources(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sources FROM last_sources WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+# Free Watchmode plans get 1000 calls a month. Set PY_WATCHMODE_MONTHLY_QUOTA for other plans
+watchmode_quota = WatchmodeQuota(
+    os.path.join(get_data_dir(), "watchmode_quota.sqlite3"),
+    monthly_quota=int(os.getenv("PY_WATCHMODE_MONTHLY_QUOTA", "1000")),
+    reserve=int(os.getenv("PY_WATCHMODE_QUOTA_RESERVE", "20")),
+)
@@ -0,0 +1,168 @@
+# Compares the cache serializer (msgpack + zstd with a trained dictionary) with plain pickle
+# Reports bytes stored and decode time per value on a corpus of real responses
+# Run from the backend folder: python -m benchmarks.bench_cache_serializer [corpus]
+# The corpus can be the tiered cache's sqlite file (the default, app/teleshow_cache/cache.sqlite3)
+# or a folder of .json files saved from TMDB. Without either it falls back to made up details responses.
+import glob
+import json
+import os
+import pickle
+import random
+import sqlite3
+import sys
+import time
+import zlib
+
+from app.cache_serializer import CacheSerializer, encode_ext, msgpack, zstandard
+
+DEFAULT_CORPUS = os.path.join("app", "teleshow_cache", "cache.sqlite3")
+
+
+def load_sqlite_corpus(path):
+    # The trained dictionaries are saved next to the sqlite file
+    serializer = CacheSerializer(os.path.dirname(path))
+    values = []
+    conn = sqlite3.connect(path)
+    for (data,) in conn.execute("SELECT value FROM cache"):
+        try:
+            values.append(serializer.loads(data))
+        except Exception:
+            # Corrupt entry or its dictionary was deleted
+            continue
+    return values
+
+
+def load_json_corpus(path):
+    values = []
+    for file in glob.glob(os.path.join(path, "*.json")):
+        with open(file, "r", encoding="utf-8") as f:
+            values.append(json.load(f))
+    return values
+
+
+# Roughly the shape of a /search/details TMDB payload with credits, images and videos appended
+def make_synthetic_corpus(count=300, seed=7):
+    rng = random.Random(seed)
+    values = []
+    for i in range(count):
+        values.append(
+            {
+                "id": i,
+                "title": f"Movie {i}",
+                "overview": " ".join(
+                    rng.choice(["a", "the", "hero", "city"]) for _ in range(60)
+                ),
+                "genres": [{"id": 28, "name": "Action"}, {"id": 18, "name": "Drama"}],
+                "credits": {
+                    "cast": [
+                        {
+                            "id": rng.randint(1, 10**6),
+                            "name": f"Actor {rng.randint(1, 5000)}",
+                            "character": f"Character {j}",
+                            "profile_path": f"/{rng.getrandbits(64):x}.jpg",
+                            "known_for_department": "Acting",
+                            "order": j,
+                        }
+                        for j in range(rng.randint(10, 60))
+                    ]
+                },
+                "images": {
+                    "backdrops": [
+                        {
+                            "file_path": f"/{rng.getrandbits(64):x}.jpg",
+                            "aspect_ratio": 1.778,
+                            "height": 1080,
+                            "width": 1920,
+                            "vote_average": rng.uniform(0, 10),
+                            "vote_count": rng.randint(0, 50),
+                        }
+                        for _ in range(rng.randint(5, 40))
+                    ]
+                },
+                "videos": {
+                    "results": [
+                        {
+                            "key": f"{rng.getrandbits(40):x}",
+                            "site": "YouTube",
+                            "type": "Trailer",
+                            "official": True,
+                        }
+                        for _ in range(rng.randint(1, 8))
+                    ]
+                },
+            }
+        )
+    return values
+
+
+def load_corpus(path):
+    if os.path.isdir(path):
+        return load_json_corpus(path), path
+    if os.path.exists(path):
+        values = load_sqlite_corpus(path)
+        if values:
+            return values, path
+    return make_synthetic_corpus(), "synthetic details responses"
+
+
+def measure(name, values, dumps, loads, repeat=5):
+    encoded = [dumps(v) for v in values]
+    total_bytes = sum(len(e) for e in encoded)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for e in encoded:
+            loads(e)
+        best = min(best, time.perf_counter() - start)
+    print(
+        f"{name:<28} {total_bytes / 1024:>10.1f} KiB {best / len(values) * 1e6:>10.1f} us/value"
+    )
+    return total_bytes
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_CORPUS
+    values, source = load_corpus(path)
+    print(f"Corpus: {len(values)} values from {source}")
+    print(f"{'serializer':<28} {'stored':>14} {'decode':>16}")
+
+    measure(
+        "pickle",
+        values,
+        lambda v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL),
+        pickle.loads,
+    )
+    measure(
+        "pickle + zlib",
+        values,
+        lambda v: zlib.compress(pickle.dumps(v, pickle.HIGHEST_PROTOCOL), 6),
+        lambda e: pickle.loads(zlib.decompress(e)),
+    )
+    if msgpack is None or zstandard is None:
+        print("msgpack and zstandard are needed for the remaining rows")
+        return
+
+    plain = CacheSerializer()
+    measure("msgpack + zstd", values, plain.dumps, plain.loads)
+
+    # Dictionary trained on the first half and measured on the second half so it isn't tested on its training data
+    half = len(values) // 2
+    trained = CacheSerializer()
+    trained.train_dictionary(
+        [msgpack.packb(v, use_bin_type=True, default=encode_ext) for v in values[:half]]
+    )
+    print(
+        f"Second half only ({len(values) - half} values), dictionary trained on the first half:"
+    )
+    measure(
+        "pickle",
+        values[half:],
+        lambda v: pickle.dumps(v, pickle.HIGHEST_PROTOCOL),
+        pickle.loads,
+    )
+    measure("msgpack + zstd", values[half:], plain.dumps, plain.loads)
+    measure("msgpack + zstd + dictionary", values[half:], trained.dumps, trained.loads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Compares Flask's standard library JSON provider with the orjson one in app/json_provider.py
+# on the biggest payloads the API sends
+#   search            - /search/ with every page of movie and tv results
+#   recommendations   - /recommendations/user with a full discover pool of each type
+#   all_episodes      - /search/tv/all_episodes for a long running show
+#   watchlists        - listener cache watchlists with Firestore timestamps on every item
+# Run from the backend folder: python -m benchmarks.bench_json
+import random
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from app.json_provider import FastJSONProvider, orjson
+from benchmarks.bench_trending_compression import make_results
+
+
+def firestore_time(rng):
+    return DatetimeWithNanoseconds(
+        2024, rng.randint(1, 12), rng.randint(1, 28), 12, 30, 0, nanosecond=123456789
+    )
+
+
+def make_episodes(rng, seasons=20, episodes=24):
+    return {
+        "seasons": [
+            {"season_number": s, "name": f"Season {s}", "episode_count": episodes}
+            for s in range(1, seasons + 1)
+        ],
+        "episodes": {
+            s: [
+                {
+                    "id": rng.randint(1, 10**7),
+                    "episode_number": e,
+                    "season_number": s,
+                    "name": f"Episode {e}",
+                    "overview": " ".join(
+                        rng.choice(["a", "the", "plan", "night", "secret"])
+                        for _ in range(40)
+                    ),
+                    "air_date": f"20{rng.randint(10, 24)}-01-01",
+                    "runtime": rng.randint(20, 60),
+                    "still_path": f"/{rng.getrandbits(64):x}.jpg",
+                    "vote_average": rng.uniform(5, 9),
+                }
+                for e in range(1, episodes + 1)
+            ]
+            for s in range(1, seasons + 1)
+        },
+    }
+
+
+def make_watchlists(rng, lists=10, items=60):
+    return {
+        "watchlists": [
+            {
+                "id": f"{rng.getrandbits(80):x}",
+                "name": f"List {w}",
+                "created_at": firestore_time(rng),
+                "updated_at": firestore_time(rng),
+                "media": [
+                    {
+                        "id": f"{rng.getrandbits(80):x}",
+                        "media_id": rng.randint(1, 10**6),
+                        "media_type": rng.choice(["movie", "tv"]),
+                        "title": f"Title {i}",
+                        "poster_path": f"/{rng.getrandbits(64):x}.jpg",
+                        "added_at": firestore_time(rng),
+                    }
+                    for i in range(items)
+                ],
+            }
+            for w in range(lists)
+        ]
+    }
+
+
+def make_payloads():
+    rng = random.Random(11)
+    return {
+        "search": {
+            "results": make_results(rng, "movie", 300) + make_results(rng, "tv", 300)
+        },
+        "recommendations": {
+            "movie_recs": make_results(rng, "movie", 400),
+            "tv_recs": make_results(rng, "tv", 400),
+        },
+        "all_episodes": make_episodes(rng),
+        "watchlists": make_watchlists(rng),
+    }
+
+
+def measure(provider, payload, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = provider.response(payload)
+        best = min(best, time.perf_counter() - start)
+    return best, len(response.get_data())
+
+
+def main():
+    app = Flask(__name__)
+    standard = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    if orjson is None:
+        print("orjson isn't installed so both providers use the standard library")
+
+    print(
+        f"{'payload':<18} {'bytes':>9} {'stdlib ms':>10} {'fast ms':>9} {'speedup':>8}"
+    )
+    for name, payload in make_payloads().items():
+        with app.app_context():
+            slow_time, size = measure(standard, payload)
+            fast_time, _ = measure(fast, payload)
+        print(
+            f"{name:<18} {size:>9} {slow_time * 1000:>10.2f} {fast_time * 1000:>9.2f} {slow_time / fast_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Compares the per item relevance scorer with the batch NumPy scorer
+# Run from the backend folder: python -m benchmarks.bench_relevance
+import random
+import string
+import timeit
+
+from app.relevance import calculate_relevance, rank_by_relevance
+
+QUERY = "the dark knight"
+WORDS = ["the", "dark", "knight", "rises", "returns", "night", "star", "wars", "love"]
+
+
+# Makes fake TMDB search results that look like the real ones
+def make_candidates(count, seed=42):
+    rng = random.Random(seed)
+    candidates = []
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        if rng.random() < 0.05:
+            title = QUERY
+        item = {
+            "id": i,
+            "popularity": rng.uniform(0, 200),
+            "vote_count": rng.randint(0, 20000),
+            "vote_average": rng.uniform(0, 10),
+        }
+        # Mix of movies and tv shows since they use different keys
+        if i % 2:
+            item["title"] = title
+            item["release_date"] = f"{rng.randint(1950, 2026)}-01-01"
+        else:
+            item["name"] = title
+            item["first_air_date"] = rng.choice(
+                ["", f"{rng.randint(1950, 2026)}-06-01"]
+            )
+        item["overview"] = "".join(rng.choices(string.ascii_lowercase, k=20))
+        candidates.append(item)
+    return candidates
+
+
+def per_item(candidates):
+    return sorted(candidates, key=lambda x: calculate_relevance(x, QUERY), reverse=True)
+
+
+def batch(candidates):
+    return rank_by_relevance(candidates, QUERY)
+
+
+def main():
+    print(f"{'candidates':>10} {'per item (ms)':>14} {'batch (ms)':>11} {'speedup':>8}")
+    for count in (20, 200, 2000):
+        candidates = make_candidates(count)
+        # Both scorers have to give the same order
+        assert [c["id"] for c in per_item(candidates)] == [
+            c["id"] for c in batch(candidates)
+        ]
+        number = max(1, 20000 // count)
+        old = timeit.timeit(lambda: per_item(candidates), number=number) / number
+        new = timeit.timeit(lambda: batch(candidates), number=number) / number
+        print(f"{count:>10} {old * 1000:>14.3f} {new * 1000:>11.3f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Checks the NumPy static encoder against sentence_transformers and compares startup time, memory and speed
+# Each encoder runs in its own process so imports and memory don't mix
+# Run from the backend folder: python -m benchmarks.bench_static_encoder
+# sentence_transformers (and torch) only need to be installed for the comparison row and the parity check
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from app.extensions import MODEL_NAME
+
+WORDS = (
+    "a the hero city family war love secret night plan journey detective ship "
+    "school dragon island murder small town friends year old captain world future"
+).split()
+
+
+def make_sentences(count=5000, seed=3):
+    rng = random.Random(seed)
+    sentences = []
+    for i in range(count):
+        # Titles and overviews, plus a few empty ones like titles without an overview
+        length = rng.choice([0, 2, 4, 30, 60])
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)))
+    return sentences
+
+
+def rss_mb():
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+# Runs inside the child process
+def run_encoder(kind, sentences_path, out_path):
+    with open(sentences_path, "r", encoding="utf-8") as f:
+        sentences = json.load(f)
+    # Memory is reported as what loading and encoding added so the app's own imports don't count
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    if kind == "numpy":
+        from app.static_encoder import StaticEncoder
+
+        model = StaticEncoder.load(MODEL_NAME)
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        model_dir = os.getenv("PY_MODEL_DIR") or MODEL_NAME
+        model = SentenceTransformer(model_dir, device="cpu")
+    load_time = time.perf_counter() - start
+
+    model.encode(sentences[:100], batch_size=16, convert_to_numpy=True)
+    start = time.perf_counter()
+    vectors = model.encode(sentences, batch_size=16, convert_to_numpy=True)
+    encode_time = time.perf_counter() - start
+    np.save(out_path, np.asarray(vectors, dtype=np.float32))
+    print(
+        json.dumps(
+            {
+                "load_s": load_time,
+                "rss_mb": rss_mb() - base_rss,
+                "sentences_per_s": len(sentences) / encode_time,
+            }
+        )
+    )
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        run_encoder(*sys.argv[2:])
+        return
+
+    workdir = tempfile.mkdtemp(prefix="teleshow-encoder-")
+    sentences_path = os.path.join(workdir, "sentences.json")
+    with open(sentences_path, "w", encoding="utf-8") as f:
+        json.dump(make_sentences(), f)
+
+    results = {}
+    for kind in ("sentence_transformers", "numpy"):
+        out_path = os.path.join(workdir, f"{kind}.npy")
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_static_encoder", "--child"]
+            + [kind, sentences_path, out_path],
+            capture_output=True,
+            text=True,
+        )
+        if child.returncode != 0:
+            print(f"{kind}: failed\n{child.stderr.strip().splitlines()[-1]}")
+            continue
+        results[kind] = json.loads(child.stdout.strip().splitlines()[-1])
+        results[kind]["vectors"] = np.load(out_path)
+
+    print(f"{'encoder':<24} {'load s':>8} {'+RSS MB':>8} {'sentences/s':>12}")
+    for kind, result in results.items():
+        print(
+            f"{kind:<24} {result['load_s']:>8.2f} {result['rss_mb']:>8.0f} {result['sentences_per_s']:>12.0f}"
+        )
+
+    if len(results) == 2:
+        a = results["sentence_transformers"]["vectors"]
+        b = results["numpy"]["vectors"]
+        diff = np.abs(a - b).max()
+        norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+        nonzero = norms > 0
+        cosine = (a * b).sum(axis=1)[nonzero] / norms[nonzero]
+        print(
+            f"Parity: max abs difference {diff:.2e}, lowest cosine similarity {cosine.min():.6f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Requests per second for a cached /trending response, compressed on every hit by flask_compress (before)
+# and sent from the gzip/brotli copies stored with the cache entry (after)
+# Run from the backend folder: python -m benchmarks.bench_trending_compression [requests]
+# Uses a made up trending body the same size and shape as the real one so TMDB isn't needed
+import random
+import sys
+import tempfile
+import time
+
+from flask import Flask, jsonify
+
+from app.extensions import cache, compress
+from app.projection import with_fields_param
+from app.view_cache import swr_cached
+
+# Accept-Encoding headers browsers send. Newer Chrome also accepts zstd which flask_compress prefers
+ACCEPT_ENCODINGS = ["gzip, deflate, br", "gzip, deflate, br, zstd", "gzip"]
+
+
+def make_results(rng, media_type, count=20):
+    results = []
+    for i in range(count):
+        results.append(
+            {
+                "id": rng.randint(1, 10**6),
+                "media_type": media_type,
+                "title": f"Title {i}",
+                "overview": " ".join(
+                    rng.choice(["a", "the", "hero", "city", "family", "war", "love"])
+                    for _ in range(rng.randint(30, 70))
+                ),
+                "poster_path": f"/{rng.getrandbits(64):x}.jpg",
+                "backdrop_path": f"/{rng.getrandbits(64):x}.jpg",
+                "release_date": f"20{rng.randint(10, 25)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+                "popularity": rng.uniform(10, 2000),
+                "vote_average": round(rng.uniform(4, 9), 3),
+                "vote_count": rng.randint(10, 30000),
+                "genre_ids": rng.sample([12, 14, 16, 18, 28, 35, 53, 80, 99, 10751], 3),
+                "original_language": rng.choice(["en", "ja", "ko", "es"]),
+            }
+        )
+    return results
+
+
+def make_app():
+    app = Flask(__name__)
+    cache.init_app(
+        app,
+        config={
+            "CACHE_TYPE": "app.tiered_cache.TieredCache",
+            "CACHE_DIR": tempfile.mkdtemp(prefix="teleshow-bench-"),
+            "CACHE_THRESHOLD": 5000,
+            "CACHE_DEFAULT_TIMEOUT": 86400,
+        },
+    )
+    compress.init_app(app)
+    # Same compression settings as extensions.init_app
+    app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+    app.config["COMPRESS_LEVEL"] = 6
+    app.config["COMPRESS_MIN_SIZE"] = 500
+
+    rng = random.Random(7)
+    body = {"movies": make_results(rng, "movie"), "tv": make_results(rng, "tv")}
+
+    @app.route("/trending")
+    @with_fields_param
+    @swr_cached(soft_ttl=3600, hard_ttl=2 * 86400)
+    def trending():
+        return jsonify(body)
+
+    return app
+
+
+def run(app, accept_encoding, requests):
+    client = app.test_client()
+    headers = {"Accept-Encoding": accept_encoding}
+    # The first request fills the cache
+    first = client.get("/trending", headers=headers)
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get("/trending", headers=headers)
+    elapsed = time.perf_counter() - start
+    return (
+        requests / elapsed,
+        response.headers.get("Content-Encoding"),
+        len(response.get_data()),
+        len(first.get_data()),
+    )
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app = make_app()
+    print(f"{requests} cached GET /trending per row")
+    print(
+        f"{'Accept-Encoding':<26} {'mode':<14} {'req/s':>10} {'encoding':>9} {'bytes':>8}"
+    )
+    for accept_encoding in ACCEPT_ENCODINGS:
+        for mode, precompress in (("per hit", False), ("precompressed", True)):
+            app.config["SWR_PRECOMPRESS"] = precompress
+            with app.app_context():
+                cache.clear()
+            rate, encoding, size, _ = run(app, accept_encoding, requests)
+            print(
+                f"{accept_encoding:<26} {mode:<14} {rate:>10.0f} {encoding or 'none':>9} {size:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
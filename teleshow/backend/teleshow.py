@@ -6,6 +6,18 @@ from app.blueprints.search import search_bp
 from app.blueprints.recommendations import recommendations_bp
 from app.blueprints.interactions import interactions_bp
 from app.extensions import cache, limiter, init_app
+from app.provider_lookup import provider_engine
+from app.availability_index import availability_index
+from app.suggest_index import suggest_index
+from app.embedding_store import embedding_store
+from app.inference_worker import inference_worker
+from app.feature_store import feature_store
+from app.blueprints.search import provider_negatives, watchmode_negatives
+from app.upstream import upstream_session
+from app.rate_budget import rate_budget
+from app.view_cache import swr_cached
+from app.projection import project, with_fields_param, SEARCH_RESULT_FIELDS
+from app import view_cache
 import os  # Used to find file paths
 import sys
 import logging
@@ -40,7 +52,30 @@ CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:5000", "file://*"]
 def cache_stats():
     return jsonify(
         {
-            "size": cache.cache._cache.__len__(),
+            "cache": cache.cache.get_stats(),
+            "provider_lookups": provider_engine.get_stats(),
+            "availability_index": availability_index.get_stats(),
+            "suggest_index": suggest_index.get_stats(),
+            "embedding_store": embedding_store.get_stats(),
+            "inference": inference_worker.get_stats(),
+            "candidate_features": feature_store.get_stats(),
+            "stale_while_revalidate": view_cache.get_stats(),
+            "negative_cache": {
+                "providers": provider_negatives.get_stats(),
+                "watchmode": watchmode_negatives.get_stats(),
+            },
+        }
+    )
+
+
+# Latency and status code histograms for every TMDB and Watchmode endpoint
+@app.route("/upstream_stats")
+def upstream_stats():
+    return jsonify(
+        {
+            "endpoints": upstream_session.get_stats(),
+            "rate_budget": rate_budget.get_stats(),
+            "circuits": upstream_session.breaker.get_stats(),
         }
     )
 
@@ -63,7 +98,9 @@ def get_logo():
 # Trending content for the home page
 @app.route("/trending", methods=["GET"])
 @limiter.limit("10 per 5 seconds")
-@cache.cached(query_string=True, timeout=3600)
+@with_fields_param
+# Served stale while it refreshes in the background after an hour, kept for two days if TMDB is down
+@swr_cached(soft_ttl=3600, hard_ttl=2 * 86400)
 def get_trending():
     try:
         movies = tmdb.Movies()
@@ -72,10 +109,14 @@ def get_trending():
         tv = tmdb.TV()
         tv_data = tv.top_rated()
 
+        # Trending titles are good suggestions for the search box
+        suggest_index.add_items(movie_data.get("results"), "movie")
+        suggest_index.add_items(tv_data.get("results"), "tv")
+
         return jsonify(
             {
-                "movies": movie_data.get("results"),
-                "tv": tv_data.get("results"),
+                "movies": project(movie_data.get("results"), SEARCH_RESULT_FIELDS),
+                "tv": project(tv_data.get("results"), SEARCH_RESULT_FIELDS),
             }
         )
     except Exception as e:
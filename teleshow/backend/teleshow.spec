@@ -6,11 +6,11 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('app/Resources', 'app/Resources'), ('.env', '.'), ('app/static', 'app/static'), ('app/templates', 'app/templates')],
-    hiddenimports=['app.blueprints.search', 'app.blueprints.recommendations', 'app.blueprints.interactions'],
+    hiddenimports=['app.blueprints.search', 'app.blueprints.recommendations', 'app.blueprints.interactions', 'app.tiered_cache', 'app.static_encoder'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['torch'],
     noarchive=False,
     optimize=0,
 )
@@ -0,0 +1,154 @@
+# Checks the NumPy static encoder against a plain mean of the token rows, and against sentence_transformers
+# when it's installed. A tiny word level model is built in a temp folder so nothing is downloaded
+# Run from the backend folder: python -m pytest tests
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers
+
+from app.static_encoder import StaticEncoder, load_safetensors
+
+VOCAB = ["[UNK]", "the", "hero", "city", "war", "love", "secret", "night", "ship"]
+DIM = 8
+
+SENTENCES = [
+    "the hero",
+    "",
+    "secret war night ship",
+    "love",
+    "the the the city",
+    "unknown words only",
+    "   ",
+    "hero, city!",
+]
+
+
+def make_tokenizer():
+    tokenizer = Tokenizer(
+        models.WordLevel({word: i for i, word in enumerate(VOCAB)}, unk_token="[UNK]")
+    )
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return tokenizer
+
+
+# Same layout as the safetensors library writes: header length, JSON header, then the raw data
+def save_safetensors(path, name, array):
+    data = array.tobytes()
+    header = json.dumps(
+        {
+            name: {
+                "dtype": "F32",
+                "shape": list(array.shape),
+                "data_offsets": [0, len(data)],
+            }
+        }
+    ).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.write(data)
+
+
+def make_model(folder, normalize=False):
+    weights = np.random.default_rng(0).normal(size=(len(VOCAB), DIM)).astype(np.float32)
+    static_dir = os.path.join(folder, "0_StaticEmbedding")
+    os.makedirs(static_dir)
+    make_tokenizer().save(os.path.join(static_dir, "tokenizer.json"))
+    save_safetensors(
+        os.path.join(static_dir, "model.safetensors"), "embedding.weight", weights
+    )
+    modules = [
+        {
+            "idx": 0,
+            "name": "0",
+            "path": "0_StaticEmbedding",
+            "type": "sentence_transformers.models.StaticEmbedding",
+        }
+    ]
+    if normalize:
+        modules.append(
+            {
+                "idx": 1,
+                "name": "1",
+                "path": "1_Normalize",
+                "type": "sentence_transformers.models.Normalize",
+            }
+        )
+    with open(os.path.join(folder, "modules.json"), "w", encoding="utf-8") as f:
+        json.dump(modules, f)
+    return weights
+
+
+# Mean of each sentence's token rows, one sentence at a time. Sentences without tokens are zero vectors
+def reference_encode(weights, sentences, normalize=False):
+    tokenizer = make_tokenizer()
+    out = np.zeros((len(sentences), weights.shape[1]), dtype=np.float32)
+    for i, sentence in enumerate(sentences):
+        ids = tokenizer.encode(sentence, add_special_tokens=False).ids
+        if ids:
+            out[i] = weights[ids].mean(axis=0)
+    if normalize:
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+    return out
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("PY_MODEL_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_safetensors_round_trip(tmp_path):
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    path = os.path.join(tmp_path, "model.safetensors")
+    save_safetensors(path, "embedding.weight", array)
+    assert np.array_equal(load_safetensors(path)["embedding.weight"], array)
+
+
+def test_matches_reference_mean(model_dir):
+    weights = make_model(model_dir)
+    encoder = StaticEncoder.load("test-model")
+    embeddings = encoder.encode(SENTENCES)
+
+    assert embeddings.shape == (len(SENTENCES), DIM)
+    assert embeddings.dtype == np.float32
+    assert np.allclose(embeddings, reference_encode(weights, SENTENCES), atol=1e-6)
+    # Empty and whitespace only sentences have no tokens
+    assert not embeddings[1].any()
+    assert not embeddings[6].any()
+
+
+def test_batches_and_single_sentence(model_dir):
+    make_model(model_dir)
+    encoder = StaticEncoder.load("test-model")
+    full = encoder.encode(SENTENCES)
+
+    assert np.allclose(encoder.encode(SENTENCES, batch_size=3), full)
+    assert np.allclose(encoder.encode(SENTENCES[2]), full[2])
+    assert encoder.encode([]).shape == (0, DIM)
+
+
+def test_normalize(model_dir):
+    weights = make_model(model_dir, normalize=True)
+    embeddings = StaticEncoder.load("test-model").encode(SENTENCES)
+
+    expected = reference_encode(weights, SENTENCES, normalize=True)
+    assert np.allclose(embeddings, expected, atol=1e-6)
+    assert not embeddings[1].any()
+
+
+def test_matches_sentence_transformers(model_dir):
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+    from sentence_transformers.models import StaticEmbedding
+
+    weights = make_model(model_dir)
+    reference = sentence_transformers.SentenceTransformer(
+        modules=[StaticEmbedding(make_tokenizer(), embedding_weights=weights)],
+        device="cpu",
+    )
+    expected = reference.encode(SENTENCES, convert_to_numpy=True)
+    embeddings = StaticEncoder.load("test-model").encode(SENTENCES)
+    assert np.allclose(embeddings, expected, atol=1e-5)